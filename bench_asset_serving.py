@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+大きなアセット配信のCPU時間のベンチマーク
+
+/uploads の大きなファイル（HOT_ASSET_MAX_FILE_SIZE を超えるVRMなど）と同じレスポンスを
+  1. 従来の方法（FileResponse の既定のチャンクサイズ）
+  2. LargeAssetResponse（LARGE_ASSET_CHUNK_SIZE のチャンク）
+の2通りで送信し、1GBあたりのCPU時間を比較する。
+送信先は受け取ったデータを捨てるだけのASGIの send なので、ネットワークの時間は含まない。
+
+使い方: python bench_asset_serving.py [ファイルサイズ(MiB)] [繰り返し回数]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from fastapi.responses import FileResponse
+
+from main import LARGE_ASSET_CHUNK_SIZE, LargeAssetResponse
+
+GIB = 1024 ** 3
+
+def make_file(directory, size_mib):
+    """ベンチマーク用のファイルを作成"""
+    path = os.path.join(directory, "asset.vrm")
+    with open(path, "wb") as f:
+        for _ in range(size_mib):
+            f.write(os.urandom(1024 * 1024))
+    return path
+
+async def send_response(response_class, path):
+    scope = {"type": "http", "method": "GET", "path": "/uploads/asset.vrm", "headers": []}
+    sent = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal sent
+        if message["type"] == "http.response.body":
+            sent += len(message.get("body", b""))
+
+    await response_class(path, stat_result=os.stat(path))(scope, receive, send)
+    return sent
+
+def measure(response_class, path, repeat):
+    asyncio.run(send_response(response_class, path))  # ウォームアップ（ページキャッシュに載せる）
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    total = 0
+    for _ in range(repeat):
+        total += asyncio.run(send_response(response_class, path))
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    return cpu / (total / GIB), wall / (total / GIB)
+
+def main():
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory, size_mib)
+        legacy_cpu, legacy_wall = measure(FileResponse, path, repeat)
+        large_cpu, large_wall = measure(LargeAssetResponse, path, repeat)
+
+    print(f"📊 大きなアセットの配信 ({size_mib} MiB × {repeat} 回, 1GBあたり)")
+    print(f"  従来 (FileResponse, {FileResponse.chunk_size // 1024:>4} KiB)        : "
+          f"CPU {legacy_cpu:6.3f} s  経過 {legacy_wall:6.3f} s")
+    print(f"  LargeAssetResponse ({LARGE_ASSET_CHUNK_SIZE // 1024:>4} KiB)          : "
+          f"CPU {large_cpu:6.3f} s  経過 {large_wall:6.3f} s")
+    print(f"  CPU時間の削減: {legacy_cpu / large_cpu:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+表示端末の起動からキャラクター表示までの時間（time-to-first-frame）のベンチマーク
+
+final_test.py と同じように uvicorn でサーバーを起動し、表示端末が起動時に行う
+リクエストの流れを再現して、フェーズごとの時間を計測する。
+
+  server_start    : プロセス起動から応答可能になるまで（init_db を含む）
+  index           : / のテンプレート描画
+  static          : index.html が参照する静的ファイル（フィンガープリント付きのURL）
+  login           : /token
+  users_me        : /users/me/
+  models          : /models/
+  backgrounds     : /backgrounds/
+  model_assets    : loadModel が読み込む最初のモデルのVRMとVRMA
+  background_asset: 最初の背景画像
+
+データは一時ディレクトリに作成したサーバーへ投入するので、作業ディレクトリのDBには影響しない。
+cold はサーバーを起動し直した直後、warm は同じサーバーに対する2回目の計測。
+結果はキーをソートしたJSONで出力するので、実行結果どうしを diff で比較できる。
+
+使い方: python bench_cold_start.py [--runs 3] [--models 3] [--animations 3] [--output bench.json]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+EMAIL = "bench@example.com"
+PASSWORD = "benchpassword123"
+# index.html から静的ファイルのURLを取り出す
+STATIC_URL_PATTERN = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+PHASES = [
+    "server_start",
+    "index",
+    "static",
+    "login",
+    "users_me",
+    "models",
+    "backgrounds",
+    "model_assets",
+    "background_asset",
+]
+
+def prepare_workdir():
+    """サーバーを動かす一時ディレクトリを作成"""
+    workdir = tempfile.mkdtemp(prefix="bench_cold_start_")
+    shutil.copy(os.path.join(PROJECT_DIR, "main.py"), workdir)
+    shutil.copytree(os.path.join(PROJECT_DIR, "templates"), os.path.join(workdir, "templates"))
+    shutil.copytree(
+        os.path.join(PROJECT_DIR, "static"),
+        os.path.join(workdir, "static"),
+        ignore=shutil.ignore_patterns("uploads"),
+    )
+    return workdir
+
+def drop_page_cache():
+    """OSのページキャッシュを破棄する（root権限が必要。失敗したらFalse）"""
+    try:
+        subprocess.run(["sync"], check=True)
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+def start_server(workdir, port):
+    """サーバーを起動し、応答するまで待つ。(プロセス, 起動にかかった秒数) を返す"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = start + 60
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("サーバーが起動直後に終了しました")
+        try:
+            requests.get(f"{base_url}/hello", timeout=1)
+            return process, time.perf_counter() - start
+        except requests.ConnectionError:
+            time.sleep(0.01)
+    process.terminate()
+    raise RuntimeError("サーバーが60秒以内に起動しませんでした")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def with_vrm_extension(glb):
+    """サンプルのGLBにVRM拡張の宣言を追加する（アップロード時の検証を通すため。描画には使わない）"""
+    json_length, _ = struct.unpack_from("<II", glb, 12)
+    document = json.loads(glb[20:20 + json_length])
+    document.setdefault("extensionsUsed", []).append("VRMC_vrm")
+    document.setdefault("extensions", {})["VRMC_vrm"] = {"specVersion": "1.0"}
+    json_chunk = json.dumps(document).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    rest = glb[20 + json_length:]
+    header = struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(json_chunk) + len(rest))
+    return header + struct.pack("<II", len(json_chunk), 0x4E4F534A) + json_chunk + rest
+
+def seed(base_url, model_count, animation_count):
+    """ベンチマーク用のユーザー・モデル・背景画像を登録"""
+    requests.post(f"{base_url}/users/", json={"email": EMAIL, "password": PASSWORD}).raise_for_status()
+    token = requests.post(f"{base_url}/token", data={"username": EMAIL, "password": PASSWORD}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    with open(os.path.join(PROJECT_DIR, "static/models/character.glb"), "rb") as f:
+        model_bytes = with_vrm_extension(f.read())
+    with open(os.path.join(PROJECT_DIR, "static/models/animation.vrma"), "rb") as f:
+        animation_bytes = f.read()
+    for i in range(model_count):
+        files = [("vrm_file", (f"model-{i}.vrm", model_bytes))]
+        files += [("vrma_files", (f"action-{j}.vrma", animation_bytes)) for j in range(animation_count)]
+        requests.post(f"{base_url}/upload/", headers=headers, data={"name": f"model-{i}"}, files=files).raise_for_status()
+    background = requests.get(f"{base_url}/static/uploads/backgrounds/default.jpg").content
+    requests.post(
+        f"{base_url}/upload-background/", headers=headers, files=[("background_file", ("background.jpg", background))]
+    ).raise_for_status()
+
+def timed(timings, phase, func):
+    start = time.perf_counter()
+    result = func()
+    timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+    return result
+
+def replay_display(base_url):
+    """表示端末の起動時のリクエストを順に実行し、フェーズごとの秒数を返す"""
+    timings = {}
+    session = requests.Session()
+
+    def get(path, **kwargs):
+        response = session.get(f"{base_url}{path}", **kwargs)
+        response.raise_for_status()
+        return response
+
+    index = timed(timings, "index", lambda: get("/"))
+    # 表示端末と同じく、index.html に書かれたURLで静的ファイルを読み込む
+    static_urls = STATIC_URL_PATTERN.findall(index.text)
+    timed(timings, "static", lambda: [get(url).content for url in static_urls])
+    token = timed(timings, "login", lambda: session.post(
+        f"{base_url}/token", data={"username": EMAIL, "password": PASSWORD}
+    ).json()["access_token"])
+    headers = {"Authorization": f"Bearer {token}"}
+    timed(timings, "users_me", lambda: get("/users/me/", headers=headers))
+    models = timed(timings, "models", lambda: get("/models/", headers=headers).json())
+    backgrounds = timed(timings, "backgrounds", lambda: get("/backgrounds/", headers=headers).json())
+    if models:
+        model = models[0]
+        timed(timings, "model_assets", lambda: [
+            get(path).content for path in [model["vrm_path"]] + [a["vrma_path"] for a in model["animations"]]
+        ])
+    if backgrounds:
+        background = backgrounds[0]
+        timed(timings, "background_asset", lambda: get(background.get("optimized_path") or background["path"]).content)
+    session.close()
+    return timings
+
+def summarize(runs):
+    """各フェーズの中央値（ミリ秒）をまとめる"""
+    summary = {}
+    for phase in PHASES + ["total"]:
+        values = [run[phase] for run in runs if phase in run]
+        if values:
+            summary[phase] = round(statistics.median(values) * 1000, 2)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="表示端末のコールドスタートのベンチマーク")
+    parser.add_argument("--runs", type=int, default=3, help="計測回数（中央値を出力）")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--models", type=int, default=3, help="投入するモデル数")
+    parser.add_argument("--animations", type=int, default=3, help="モデルあたりのアニメーション数")
+    parser.add_argument("--drop-caches", action="store_true", help="cold の計測前にOSのページキャッシュを破棄する")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir()
+    base_url = f"http://127.0.0.1:{args.port}"
+    cold_runs, warm_runs = [], []
+    page_cache_dropped = False
+    try:
+        process, _ = start_server(workdir, args.port)
+        try:
+            seed(base_url, args.models, args.animations)
+        finally:
+            stop_server(process)
+
+        for _ in range(args.runs):
+            if args.drop_caches:
+                page_cache_dropped = drop_page_cache()
+            process, startup = start_server(workdir, args.port)
+            try:
+                cold = replay_display(base_url)
+                cold["server_start"] = startup
+                cold["total"] = sum(cold.values())
+                warm = replay_display(base_url)
+                warm["total"] = sum(warm.values())
+            finally:
+                stop_server(process)
+            cold_runs.append(cold)
+            warm_runs.append(warm)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "config": {
+            "runs": args.runs,
+            "models": args.models,
+            "animations_per_model": args.animations,
+            "page_cache_dropped": page_cache_dropped,
+        },
+        "cold_ms": summarize(cold_runs),
+        "warm_ms": summarize(warm_runs),
+    }
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"📊 結果を書き出しました: {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+一覧エンドポイントのJSONシリアライズのベンチマーク
+
+/models/ と同じデータを
+  1. 従来の方法（ORMオブジェクト → Pydanticで検証 → 標準JSONでシリアライズ）
+  2. 高速パス（列の射影で辞書を作成 → orjsonでシリアライズ）
+の2通りで作成し、かかった時間を比較する。
+
+使い方: python bench_serialization.py [モデル数] [モデルあたりのアニメーション数]
+"""
+import sys
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import (
+    Base,
+    FastJSONResponse,
+    User,
+    VRMAnimation,
+    VRMModel,
+    VRMModelBase,
+    get_vrm_models,
+    list_vrm_model_dicts,
+)
+
+REPEAT = 20
+
+def seed(db, model_count, animations_per_model):
+    """ベンチマーク用のデータを作成"""
+    user = User(email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    for i in range(model_count):
+        model = VRMModel(name=f"model-{i}", vrm_path=f"/uploads/{user.id}/model-{i}.vrm", user_id=user.id)
+        db.add(model)
+        db.flush()
+        db.add_all([
+            VRMAnimation(
+                anim_name=f"anim-{i}-{j}",
+                vrma_path=f"/uploads/{user.id}/animations/anim-{i}-{j}.vrma",
+                model_id=model.id,
+                user_id=user.id,
+            )
+            for j in range(animations_per_model)
+        ])
+    db.commit()
+    return user.id
+
+def legacy_path(SessionLocal, user_id, adapter):
+    """従来の response_model による処理"""
+    db = SessionLocal()
+    try:
+        models = get_vrm_models(db, user_id=user_id)
+        validated = adapter.validate_python(models, from_attributes=True)
+        return JSONResponse(jsonable_encoder(validated)).body
+    finally:
+        db.close()
+
+def fast_path(SessionLocal, user_id):
+    """射影 + orjson による処理"""
+    db = SessionLocal()
+    try:
+        return FastJSONResponse(list_vrm_model_dicts(db, user_id)).body
+    finally:
+        db.close()
+
+def measure(func, *args):
+    func(*args)  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        body = func(*args)
+    return (time.perf_counter() - start) / REPEAT, len(body)
+
+def main():
+    model_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    animations_per_model = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    try:
+        user_id = seed(db, model_count, animations_per_model)
+    finally:
+        db.close()
+
+    adapter = TypeAdapter(List[VRMModelBase])
+    legacy_time, legacy_size = measure(legacy_path, SessionLocal, user_id, adapter)
+    fast_time, fast_size = measure(fast_path, SessionLocal, user_id)
+
+    print(f"📊 /models/ シリアライズ ({model_count} モデル × {animations_per_model} アニメーション, {REPEAT} 回平均)")
+    print(f"  JSONレスポンスクラス: {FastJSONResponse.__name__}")
+    print(f"  従来 (ORM + Pydantic + json): {legacy_time * 1000:8.2f} ms  ({legacy_size} bytes)")
+    print(f"  高速 (射影 + orjson)        : {fast_time * 1000:8.2f} ms  ({fast_size} bytes)")
+    print(f"  高速化: {legacy_time / fast_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
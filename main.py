@@ -4,30 +4,70 @@
 すべてのモデル、スキーマ、CRUD、認証機能を含む単一ファイル
 """
 
+import asyncio
+import ctypes
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import multiprocessing
 import os
+import platform
+import queue
 import uuid
 import warnings
+import zlib
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as clock_time
 from pathlib import Path
 import shutil
+import signal
+import struct
+import tarfile
+import tempfile
+from collections import OrderedDict
+import threading
+import time
 import traceback
+from bisect import bisect_right
+import heapq
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # FastAPI関連のインポート
 from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.staticfiles import NotModifiedResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, PlainTextResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
+from fastapi.encoders import jsonable_encoder
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+# ワーカー間のロックに使う（Windowsにはないので、その場合はシングルプロセスのロックだけ使う）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# orjsonがあれば高速なJSONレスポンスを使う（オプション）
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
 
 # SQLAlchemy関連のインポート
-from sqlalchemy import create_engine, Boolean, Column, ForeignKey, Integer, String, DateTime, inspect
+from sqlalchemy import create_engine, event, insert, or_, Boolean, Column, ForeignKey, Integer, String, DateTime, UniqueConstraint, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker, Session
 from sqlalchemy.sql import func
 
 # Pydantic関連のインポート
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
 # セキュリティ関連のインポート
 from passlib.context import CryptContext
@@ -40,11 +80,22 @@ from jose import JWTError, jwt
 # SQLiteデータベースのURLを指定
 SQLALCHEMY_DATABASE_URL = "sqlite:///./database_new.db"
 
+# 他の接続が書き込み中のときにロック解除を待つ時間（ミリ秒）
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
 # エンジンを作成
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+# 複数のワーカープロセスから同時に読み書きできるようにWALモードにする
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
 # セッションのローカルクラスを作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -79,6 +130,8 @@ class User(Base):
     vrm_models = relationship("VRMModel", back_populates="user", cascade="all, delete-orphan")
     vrm_animations = relationship("VRMAnimation", back_populates="user", cascade="all, delete-orphan")
     backgrounds = relationship("Background", back_populates="user", cascade="all, delete-orphan")
+    schedule_slots = relationship("ScheduleSlot", back_populates="user", cascade="all, delete-orphan")
+    devices = relationship("Device", back_populates="user", cascade="all, delete-orphan")
 
 # VRMモデル
 class VRMModel(Base):
@@ -93,6 +146,7 @@ class VRMModel(Base):
 
     user = relationship("User", back_populates="vrm_models")
     animations = relationship("VRMAnimation", back_populates="model", cascade="all, delete-orphan")
+    schedule_slots = relationship("ScheduleSlot", back_populates="model", cascade="all, delete-orphan")
 
 # VRMアニメーション
 class VRMAnimation(Base):
@@ -108,6 +162,8 @@ class VRMAnimation(Base):
 
     user = relationship("User", back_populates="vrm_animations")
     model = relationship("VRMModel", back_populates="animations")
+    # 削除時はスケジュール側の animation_id が NULL になる
+    schedule_slots = relationship("ScheduleSlot", back_populates="animation")
 
 # 背景画像モデル
 class Background(Base):
@@ -120,9 +176,133 @@ class Background(Base):
     path = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id"))
+    # GIFを変換したアニメーションWebP（変換前・変換失敗時はNULL、元のGIFはそのまま残す）
+    optimized_path = Column(String, nullable=True)
+    frame_count = Column(Integer, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
     
     # リレーションシップ
     user = relationship("User", back_populates="backgrounds")
+    # 削除時はスケジュール側の background_id が NULL になる
+    schedule_slots = relationship("ScheduleSlot", back_populates="background")
+
+# スケジュール枠モデル
+class ScheduleSlot(Base):
+    """表示するモデル・アニメーション・背景を時間帯で指定する枠
+
+    繰り返し枠は days_of_week（月曜=bit0 ... 日曜=bit6 のビットマスク）と
+    start_minute / end_minute（0時からの分）で、1回限りの枠は starts_at / ends_at で指定する。
+    """
+    __tablename__ = "schedule_slots"
+    __table_args__ = {'extend_existing': True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    model_id = Column(Integer, ForeignKey("vrm_models.id"), nullable=False)
+    animation_id = Column(Integer, ForeignKey("vrm_animations.id"), nullable=True)
+    background_id = Column(Integer, ForeignKey("backgrounds.id"), nullable=True)
+    priority = Column(Integer, nullable=False, default=0)
+    days_of_week = Column(Integer, nullable=True)
+    start_minute = Column(Integer, nullable=True)
+    end_minute = Column(Integer, nullable=True)
+    starts_at = Column(DateTime, nullable=True)
+    ends_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    user = relationship("User", back_populates="schedule_slots")
+    model = relationship("VRMModel", back_populates="schedule_slots")
+    animation = relationship("VRMAnimation", back_populates="schedule_slots")
+    background = relationship("Background", back_populates="schedule_slots")
+
+# 表示端末（ディスプレイ）モデル
+class Device(Base):
+    """ハートビートを送ってくる表示端末。現在の表示内容は端末からの報告をそのまま保存する"""
+    __tablename__ = "devices"
+    __table_args__ = (
+        UniqueConstraint("user_id", "device_key"),
+        {'extend_existing': True},
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    device_key = Column(String, nullable=False)
+    name = Column(String, nullable=True)
+    current_model_id = Column(Integer, nullable=True)
+    current_background_id = Column(Integer, nullable=True)
+    state = Column(String, nullable=True)
+    last_seen_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    user = relationship("User", back_populates="devices")
+
+# ライブラリのバージョン（ユーザーごと。モデル・アニメーション・背景画像が変わるたびに増える）
+class LibraryVersion(Base):
+    __tablename__ = "library_versions"
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# ライブラリの変更履歴（差分取得用）
+class LibraryChange(Base):
+    __tablename__ = "library_changes"
+    __table_args__ = {'extend_existing': True}
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # model / animation / background
+    object_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # upsert / delete
+
+# アップロードファイルの最終アクセス日時（階層化ストレージでコールド層へ移すファイルの判定に使う）
+class AssetAccess(Base):
+    __tablename__ = "asset_access"
+    __table_args__ = {'extend_existing': True}
+
+    path = Column(String, primary_key=True)  # uploads からの相対パス
+    last_accessed_at = Column(DateTime, nullable=False)
+
+# 再生ログ（端末から送られた再生イベントをそのまま追記する）
+class PlaybackEvent(Base):
+    __tablename__ = "playback_events"
+    __table_args__ = {'extend_existing': True}
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    device_key = Column(String, nullable=False)
+    model_id = Column(Integer, nullable=False)
+    animation_id = Column(Integer, nullable=True)
+    anim_name = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Integer, nullable=False)
+
+# 再生回数の時間別集計（端末・モデル・アニメーションごと）
+class PlaybackHourlyRollup(Base):
+    __tablename__ = "playback_hourly_rollups"
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    hour_start = Column(DateTime, primary_key=True)
+    device_key = Column(String, primary_key=True)
+    model_id = Column(Integer, primary_key=True)
+    anim_name = Column(String, primary_key=True)
+    plays = Column(Integer, nullable=False, default=0)
+    total_duration_ms = Column(Integer, nullable=False, default=0)
+
+# 再生回数のアセット別集計（全期間）
+class PlaybackAssetRollup(Base):
+    __tablename__ = "playback_asset_rollups"
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    model_id = Column(Integer, primary_key=True)
+    anim_name = Column(String, primary_key=True)
+    plays = Column(Integer, nullable=False, default=0)
+    total_duration_ms = Column(Integer, nullable=False, default=0)
+    last_played_at = Column(DateTime, nullable=True)
 
 # =======================
 # Pydanticスキーマ
@@ -186,6 +366,11 @@ class BackgroundBase(BaseModel):
     id: int
     filename: str
     path: str
+    optimized_path: Optional[str] = None
+    frame_count: Optional[int] = None
+    duration_ms: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -196,6 +381,85 @@ class BackgroundCreate(BaseModel):
     path: str
     user_id: int
 
+# スケジュール枠の作成用モデル
+class ScheduleSlotCreate(BaseModel):
+    model_id: int
+    animation_id: Optional[int] = None
+    background_id: Optional[int] = None
+    priority: int = 0
+    # 繰り返し枠: 曜日（0=月曜 ... 6=日曜）と開始・終了時刻（終了が開始以前なら翌日まで）
+    days_of_week: Optional[List[int]] = None
+    start_time: Optional[clock_time] = None
+    end_time: Optional[clock_time] = None
+    # 1回限りの枠: 開始・終了日時
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+
+    class Config:
+        # model_id という列名を使うため、Pydanticの予約名前空間の警告を無効にする
+        protected_namespaces = ()
+
+# ハートビートで受け付ける文字列の長さの上限
+DEVICE_KEY_MAX_LENGTH = 64
+DEVICE_NAME_MAX_LENGTH = 100
+DEVICE_STATE_MAX_LENGTH = 64
+
+# ハートビート用モデル
+class DeviceHeartbeat(BaseModel):
+    device_key: str = Field(min_length=1, max_length=DEVICE_KEY_MAX_LENGTH)
+    name: Optional[str] = Field(default=None, max_length=DEVICE_NAME_MAX_LENGTH)
+    model_id: Optional[int] = None
+    background_id: Optional[int] = None
+    state: Optional[str] = Field(default=None, max_length=DEVICE_STATE_MAX_LENGTH)
+
+    class Config:
+        protected_namespaces = ()
+
+# 端末状態の表示用モデル
+class DeviceStatus(BaseModel):
+    device_key: str
+    name: Optional[str] = None
+    model_id: Optional[int] = None
+    background_id: Optional[int] = None
+    state: Optional[str] = None
+    last_seen_at: Optional[datetime] = None
+    online: bool
+
+    class Config:
+        protected_namespaces = ()
+
+# 再生イベント用モデル
+class PlaybackEventIn(BaseModel):
+    model_id: int
+    animation_id: Optional[int] = None
+    anim_name: str = ""
+    started_at: datetime
+    duration_ms: int
+
+    class Config:
+        protected_namespaces = ()
+
+# 再生イベントの一括送信用モデル
+class PlaybackEventBatch(BaseModel):
+    device_key: str
+    events: List[PlaybackEventIn]
+
+# スケジュール枠の表示用モデル
+class ScheduleSlotSchema(BaseModel):
+    id: int
+    model_id: int
+    animation_id: Optional[int] = None
+    background_id: Optional[int] = None
+    priority: int
+    days_of_week: Optional[List[int]] = None
+    start_time: Optional[clock_time] = None
+    end_time: Optional[clock_time] = None
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+
+    class Config:
+        protected_namespaces = ()
+
 # =======================
 # 認証設定
 # =======================
@@ -270,6 +534,596 @@ async def get_current_user(db: Session = Depends(get_db), token: str = Depends(o
 async def get_current_active_user(current_user: UserSchema = Depends(get_current_user)):
     return current_user
 
+# メールアドレス → ユーザーID のキャッシュ（頻繁に呼ばれるエンドポイントでDB参照を省く）
+user_id_cache: dict = {}
+
+# 現在のユーザーIDだけを取得（キャッシュにあればDBを参照しない）
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        email: str = payload.get("sub")
+        if email is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    user_id = user_id_cache.get(email)
+    if user_id is None:
+        db = SessionLocal()
+        try:
+            user = get_user_by_email(db, email)
+        finally:
+            db.close()
+        if user is None:
+            raise credentials_exception
+        user_id = user_id_cache[email] = user.id
+    return user_id
+
+# =======================
+# GLB（VRM / VRMA）の検証
+# =======================
+
+GLB_MAGIC = b"glTF"
+GLB_VERSION = 2
+GLB_HEADER = struct.Struct("<4sII")  # magic, version, 全体の長さ
+GLB_CHUNK_HEADER = struct.Struct("<II")  # チャンクの長さ, 種類
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+# JSONチャンクの最大サイズ（バイト）。JSONだけはメモリに読み込んで解析する
+GLB_MAX_JSON_CHUNK_SIZE = int(os.getenv("GLB_MAX_JSON_CHUNK_SIZE", str(16 * 1024 * 1024)))
+# 表示端末が読み込めるファイルに必要な拡張（いずれか1つ）
+VRM_MODEL_EXTENSIONS = ("VRMC_vrm", "VRM")
+VRM_ANIMATION_EXTENSIONS = ("VRMC_vrm_animation",)
+
+class InvalidAssetError(ValueError):
+    """アップロードされたファイルがVRM / VRMAとして読み込めない"""
+
+class GLBStreamValidator:
+    """GLBファイルの構造を、データを先頭から少しずつ受け取りながら検証する
+
+    ヘッダー（magic・バージョン・全体の長さ）、各チャンクの長さと種類、JSONチャンクの
+    asset.version と必要な拡張を確認する。バイナリチャンクの中身は読み飛ばすので、
+    メモリに保持するのはJSONチャンクだけ。問題が見つかった時点で InvalidAssetError を送出する。
+    """
+
+    def __init__(self, required_extensions: tuple):
+        self.required_extensions = required_extensions
+        self.position = 0
+        self.length: Optional[int] = None
+        self.chunk_count = 0
+        self._buffer = bytearray()
+        self._state = "header"  # header / chunk_header / json / skip
+        self._need = GLB_HEADER.size
+
+    def feed(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            if self.length is not None and self.position + len(view) > self.length:
+                raise InvalidAssetError("ヘッダーの長さより後ろに余分なデータがあります")
+            taken = min(self._need, len(view))
+            if self._state != "skip":
+                # バイナリチャンク以外は必要な長さが揃うまでためる
+                self._buffer += view[:taken]
+            view = view[taken:]
+            self.position += taken
+            self._need -= taken
+            if self._need == 0:
+                data, self._buffer = bytes(self._buffer), bytearray()
+                self._advance(data)
+
+    def _advance(self, data: bytes):
+        """読み込みが揃った部分を解析して次の状態へ進む"""
+        if self._state == "header":
+            magic, version, length = GLB_HEADER.unpack(data)
+            if magic != GLB_MAGIC:
+                raise InvalidAssetError("GLB（glTFバイナリ）形式ではありません")
+            if version != GLB_VERSION:
+                raise InvalidAssetError(f"GLBのバージョン {version} には対応していません")
+            if length < GLB_HEADER.size + GLB_CHUNK_HEADER.size:
+                raise InvalidAssetError("GLBの長さが不正です")
+            self.length = length
+        elif self._state == "chunk_header":
+            chunk_length, chunk_type = GLB_CHUNK_HEADER.unpack(data)
+            self.chunk_count += 1
+            if self.position + chunk_length > self.length:
+                raise InvalidAssetError("チャンクの長さがファイルの長さを超えています")
+            if self.chunk_count == 1:
+                if chunk_type != GLB_CHUNK_JSON:
+                    raise InvalidAssetError("最初のチャンクがJSONではありません")
+                if chunk_length > GLB_MAX_JSON_CHUNK_SIZE:
+                    raise InvalidAssetError("JSONチャンクが大きすぎます")
+            elif chunk_type == GLB_CHUNK_JSON:
+                raise InvalidAssetError("JSONチャンクが複数あります")
+            elif chunk_type == GLB_CHUNK_BIN and self.chunk_count != 2:
+                raise InvalidAssetError("BINチャンクはJSONチャンクの直後にしか置けません")
+            self._state = "json" if self.chunk_count == 1 else "skip"
+            self._need = chunk_length
+            if chunk_length > 0:
+                return
+            if self._state == "json":
+                self._check_json(b"")
+        elif self._state == "json":
+            self._check_json(data)
+        self._state = "chunk_header"
+        self._need = GLB_CHUNK_HEADER.size
+
+    def _check_json(self, data: bytes):
+        try:
+            document = json.loads(data)
+        except ValueError:
+            raise InvalidAssetError("JSONチャンクを解析できません")
+        if not isinstance(document, dict):
+            raise InvalidAssetError("JSONチャンクの形式が不正です")
+        asset = document.get("asset")
+        if not isinstance(asset, dict) or not str(asset.get("version", "")).startswith("2."):
+            raise InvalidAssetError("glTF 2.0 のファイルではありません")
+        used = document.get("extensionsUsed") or []
+        extensions = document.get("extensions") or {}
+        if not isinstance(used, list) or not isinstance(extensions, dict) or not any(
+            name in used and isinstance(extensions.get(name), dict) for name in self.required_extensions
+        ):
+            raise InvalidAssetError(f"{' / '.join(self.required_extensions)} 拡張がありません")
+
+    def finish(self):
+        """全データを受け取ったあとに呼び、途中で切れていないことを確認する"""
+        if self.length is None or self.chunk_count == 0:
+            raise InvalidAssetError("GLBのデータが不足しています")
+        if self.position != self.length or self._state != "chunk_header" or self._buffer:
+            raise InvalidAssetError("GLBのデータが途中で切れています")
+
+# =======================
+# ワーカー間の共有ロック
+# =======================
+
+class SharedFileLock:
+    """fork したワーカープロセス間で共有するロック
+
+    fork 前に作成した一時ファイルに fcntl のレコードロックをかける。ロックを持ったままプロセスが
+    異常終了してもカーネルが解放するので、multiprocessing.Lock のように他のワーカーが止まることはない。
+    レコードロックは同じプロセスのスレッドどうしを排他しないので、threading.Lock と組み合わせる。
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile() if fcntl is not None else None
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._file is not None:
+            try:
+                fcntl.lockf(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if self._file is not None:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+# =======================
+# アップロード制御
+# =======================
+
+# 同時に処理するアップロード数（全体・ユーザーごと）
+UPLOAD_MAX_CONCURRENT = int(os.getenv("UPLOAD_MAX_CONCURRENT", "2"))
+UPLOAD_MAX_CONCURRENT_PER_USER = int(os.getenv("UPLOAD_MAX_CONCURRENT_PER_USER", "1"))
+# 同時に受け付けるアップロードの合計バイト数（Content-Length の合計）
+UPLOAD_MAX_BYTES_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_BYTES_IN_FLIGHT", str(256 * 1024 * 1024)))
+# 空きを待つ最大時間（秒）と、503 で返す Retry-After（秒）
+UPLOAD_QUEUE_TIMEOUT = float(os.getenv("UPLOAD_QUEUE_TIMEOUT", "10"))
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "5"))
+# アップロードの書き込みスレッドの nice 値（CPUの優先度）
+UPLOAD_IO_NICE = int(os.getenv("UPLOAD_IO_NICE", "10"))
+# アップロードの書き込みスレッドのI/O優先度クラス（ioprio_set の idle クラス）
+UPLOAD_IO_PRIORITY_IDLE = os.getenv("UPLOAD_IO_PRIORITY_IDLE", "true").lower() == "true"
+UPLOAD_IO_CHUNK_SIZE = 1024 * 1024
+
+# ユーザーごとの同時実行数を数える共有メモリの枠の数（ユーザーはハッシュで枠に割り当てる）
+UPLOAD_USER_SLOTS = int(os.getenv("UPLOAD_USER_SLOTS", "1024"))
+# 他のワーカーで空きが出たかを確認する間隔（秒）
+UPLOAD_ADMISSION_POLL_INTERVAL = float(os.getenv("UPLOAD_ADMISSION_POLL_INTERVAL", "0.05"))
+
+# 流量制御の対象になるパス
+UPLOAD_PATHS = {"/upload/", "/upload-background/", "/library/import"}
+
+class UploadAdmissionController:
+    """アップロードの同時実行数と転送中バイト数を制限する
+
+    上限を超えたリクエストは空きが出るまで待ち、待ち時間が上限を超えたら拒否する。
+    カウンタはfork前に作成した共有メモリに置くので、マルチワーカーでも上限はサーバー全体で効く。
+    ユーザーごとの数はユーザーキーのハッシュで決まる枠で数える（枠が衝突したユーザーどうしは上限を共有する）。
+    同じプロセス内の解放は Condition で、他のワーカーの解放は一定間隔の再確認で待っている側に伝わる。
+
+    確保した枠はワーカーごとの行にも記録し、ワーカーが異常終了したら親プロセスが reclaim で返却する。
+    """
+
+    ACTIVE, BYTES_IN_FLIGHT = range(2)
+
+    def __init__(self, max_concurrent: int = UPLOAD_MAX_CONCURRENT,
+                 max_per_user: int = UPLOAD_MAX_CONCURRENT_PER_USER,
+                 max_bytes: int = UPLOAD_MAX_BYTES_IN_FLIGHT,
+                 timeout: float = UPLOAD_QUEUE_TIMEOUT,
+                 user_slots: int = UPLOAD_USER_SLOTS,
+                 workers: int = 1):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.user_slots = user_slots
+        self._lock = SharedFileLock()
+        self._condition: Optional[asyncio.Condition] = None
+        self.prepare(workers)
+
+    def prepare(self, workers: int):
+        """共有メモリを確保する（fork前に、ワーカー数を指定して呼ぶ）"""
+        self.workers = max(workers, 1)
+        self._counters = multiprocessing.RawArray("q", 2)
+        self._per_user = multiprocessing.RawArray("q", self.user_slots)
+        # ワーカーごとの行: [処理中の数, 転送中のバイト数, ユーザーの枠ごとの数...]
+        self._row_size = 2 + self.user_slots
+        self._held = multiprocessing.RawArray("q", self.workers * self._row_size)
+
+    @property
+    def active(self) -> int:
+        return self._counters[self.ACTIVE]
+
+    @property
+    def bytes_in_flight(self) -> int:
+        return self._counters[self.BYTES_IN_FLIGHT]
+
+    def _weight(self, size: int) -> int:
+        # 上限より大きいリクエストも、他に何も転送していなければ受け付ける
+        return min(max(size, 0), self.max_bytes)
+
+    def _slot(self, user_key: str) -> int:
+        return zlib.crc32(user_key.encode("utf-8")) % len(self._per_user)
+
+    def _update(self, row: int, slot: int, weight: int, delta: int):
+        # self._lock を保持して呼ぶ。合計とワーカーの行を同じだけ増減する
+        base = row * self._row_size
+        self._counters[self.ACTIVE] += delta
+        self._counters[self.BYTES_IN_FLIGHT] += delta * weight
+        self._per_user[slot] += delta
+        self._held[base + self.ACTIVE] += delta
+        self._held[base + self.BYTES_IN_FLIGHT] += delta * weight
+        self._held[base + 2 + slot] += delta
+
+    def _try_admit(self, user_key: str, size: int) -> bool:
+        """空きがあれば確保する（確認と確保は共有メモリのロックの中で行う）"""
+        slot = self._slot(user_key)
+        weight = self._weight(size)
+        with self._lock:
+            if (
+                self._counters[self.ACTIVE] >= self.max_concurrent
+                or self._per_user[slot] >= self.max_per_user
+                or self._counters[self.BYTES_IN_FLIGHT] + weight > self.max_bytes
+            ):
+                return False
+            self._update(WORKER_INDEX, slot, weight, 1)
+            return True
+
+    async def acquire(self, user_key: str, size: int) -> bool:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        async with self._condition:
+            while not self._try_admit(user_key, size):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait(), min(remaining, UPLOAD_ADMISSION_POLL_INTERVAL)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            return True
+
+    async def release(self, user_key: str, size: int):
+        with self._lock:
+            self._update(WORKER_INDEX, self._slot(user_key), self._weight(size), -1)
+        async with self._condition:
+            self._condition.notify_all()
+
+    def reclaim(self, index: int) -> int:
+        """終了したワーカーが確保したままの枠を返却し、返却した数を返す（親プロセスで呼ぶ）"""
+        base = index * self._row_size
+        with self._lock:
+            active = self._held[base + self.ACTIVE]
+            self._counters[self.ACTIVE] -= active
+            self._counters[self.BYTES_IN_FLIGHT] -= self._held[base + self.BYTES_IN_FLIGHT]
+            for slot in range(self.user_slots):
+                if self._held[base + 2 + slot]:
+                    self._per_user[slot] -= self._held[base + 2 + slot]
+            for offset in range(self._row_size):
+                self._held[base + offset] = 0
+        return active
+
+    def status(self) -> dict:
+        return {
+            "active": self.active,
+            "bytes_in_flight": self.bytes_in_flight,
+            "max_concurrent": self.max_concurrent,
+            "max_concurrent_per_user": self.max_per_user,
+            "max_bytes_in_flight": self.max_bytes,
+        }
+
+upload_admission = UploadAdmissionController()
+
+# アップロードを行うユーザーを識別するキー（トークンの検証はエンドポイント側で行う）
+def upload_user_key(headers: Headers, scope) -> str:
+    authorization = headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    client = scope.get("client")
+    return f"client:{client[0] if client else 'unknown'}"
+
+class UploadAdmissionMiddleware:
+    """アップロードのリクエストボディを読み込む前に流量制御を行うASGIミドルウェア"""
+
+    def __init__(self, app, controller: UploadAdmissionController, paths=UPLOAD_PATHS):
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        user_key = upload_user_key(headers, scope)
+        try:
+            size = int(headers.get("content-length", "0"))
+        except ValueError:
+            size = 0
+        if not await self.controller.acquire(user_key, size):
+            response = JSONResponse(
+                {"detail": "アップロードが混み合っています。しばらくしてから再試行してください。"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(UPLOAD_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.controller.release(user_key, size)
+
+# ioprio_set のシステムコール番号（アーキテクチャごとに異なる）
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "armv7l": 314, "armv6l": 314, "i686": 289}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+def _set_idle_io_priority(thread_id: int) -> bool:
+    """スレッドのI/O優先度を idle クラスにする
+
+    nice 値はCPUの優先度にしか効かないので、I/Oの優先度は ioprio_set で別に設定する。
+    idle クラスは BFQ と mq-deadline（Linux 5.14以降）で効き、none スケジューラでは効果がない。
+    """
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.syscall(number, IOPRIO_WHO_PROCESS, thread_id, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0
+    except (AttributeError, OSError):
+        return False
+
+# アップロード書き込み用スレッドの優先度を下げる（Linuxではスレッド単位で設定できる）
+def _lower_upload_io_priority():
+    try:
+        thread_id = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, thread_id, UPLOAD_IO_NICE)
+    except (AttributeError, OSError):
+        return
+    if UPLOAD_IO_PRIORITY_IDLE and not _set_idle_io_priority(thread_id):
+        print("警告: アップロード書き込みスレッドのI/O優先度を設定できませんでした")
+
+# アップロードの書き込みは専用の低優先度スレッドで1件ずつ行う
+# /uploads の読み込みとの競合は、I/O優先度と書き込み後の posix_fadvise（ページキャッシュを押し出さない）で抑える
+upload_io_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="upload-io", initializer=_lower_upload_io_priority
+)
+
+def _copy_upload_file(source, file_path: str, validator: Optional[GLBStreamValidator] = None,
+                      publish: bool = True) -> str:
+    """一時ファイル（.part）に書き込み、最後まで書けたら本来の名前に変える
+
+    source は現在位置から読む。validator を渡すと各チャンクを書き込む前に検証するので、不正なデータは書き込まれない。
+    publish=False なら .part のまま残して、そのパスを返す（名前の変更は呼び出し側で行う）。
+    """
+    part_path = file_path + ".part"
+    try:
+        with open(part_path, "wb") as buffer:
+            while True:
+                chunk = source.read(UPLOAD_IO_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if validator is not None:
+                    validator.feed(chunk)
+                buffer.write(chunk)
+            if validator is not None:
+                validator.finish()
+            buffer.flush()
+            # 書き込んだデータで表示用アセットのページキャッシュを押し出さないようにする
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(buffer.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        if not publish:
+            return part_path
+        os.replace(part_path, file_path)
+        return file_path
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+
+# アップロードファイルを保存する（required_extensions を指定するとVRM / VRMAとして検証する）
+# publish=False なら file_path + ".part" に書いたままにして、そのパスを返す
+async def save_upload_file(upload_file: UploadFile, file_path: str, required_extensions: Optional[tuple] = None,
+                           publish: bool = True) -> str:
+    validator = GLBStreamValidator(required_extensions) if required_extensions else None
+    loop = asyncio.get_running_loop()
+    await upload_file.seek(0)
+    try:
+        return await loop.run_in_executor(
+            upload_io_executor, _copy_upload_file, upload_file.file, file_path, validator, publish
+        )
+    except InvalidAssetError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{upload_file.filename}: {e}"
+        )
+
+# =======================
+# プロセス間のキャッシュ無効化
+# =======================
+
+# サーバーのワーカープロセス数（2以上でマルチワーカー起動）
+SERVER_WORKERS = int(os.getenv("WORKERS", "1"))
+# このプロセスのワーカー番号（シングルプロセスでは0）
+WORKER_INDEX = 0
+
+class InvalidationBus:
+    """キャッシュの無効化をワーカープロセス間で伝える世代カウンタ
+
+    トピックごとのカウンタを共有メモリに置き、無効化のたびに1つ進める。fork前に作成するので
+    すべてのワーカーが同じカウンタを参照する。各プロセスのキャッシュは参照時に最後に見た世代と比べ、
+    進んでいれば手元の内容を捨てる（読み取りはロックなしの共有メモリの参照だけ）。
+    """
+
+    TOPICS = ("library", "schedule")
+
+    def __init__(self):
+        self._counters = multiprocessing.RawArray("Q", len(self.TOPICS))
+        self._lock = SharedFileLock()
+
+    def generation(self, topic: str) -> int:
+        return self._counters[self.TOPICS.index(topic)]
+
+    def publish(self, topic: str) -> int:
+        index = self.TOPICS.index(topic)
+        with self._lock:
+            self._counters[index] += 1
+            return self._counters[index]
+
+invalidation_bus = InvalidationBus()
+
+class GenerationWatcher:
+    """キャッシュごとに最後に見た世代を覚えておき、他のプロセスによる無効化を検出する"""
+
+    def __init__(self, bus: InvalidationBus, topic: str):
+        self.bus = bus
+        self.topic = topic
+        self.seen = bus.generation(topic)
+
+    def expired(self) -> bool:
+        current = self.bus.generation(self.topic)
+        if current == self.seen:
+            return False
+        self.seen = current
+        return True
+
+    def publish(self):
+        previous = self.seen
+        current = self.bus.publish(self.topic)
+        # 間に他のプロセスの無効化がなければ、自分の変更は反映済みなので手元のキャッシュは捨てなくてよい
+        if current == previous + 1:
+            self.seen = current
+
+# =======================
+# ライブラリのバージョン管理
+# =======================
+
+class LibraryVersionCache:
+    """ユーザーごとのライブラリのバージョンをメモリに保持する（値は増える方向にしか更新しない）"""
+
+    def __init__(self):
+        self._versions: dict = {}
+        self._lock = threading.Lock()
+        self._watcher = GenerationWatcher(invalidation_bus, "library")
+
+    def remember(self, user_id: int, version: int) -> int:
+        with self._lock:
+            version = max(self._versions.get(user_id, 0), version)
+            self._versions[user_id] = version
+            return version
+
+    def changed(self, user_id: int, version: int) -> int:
+        """コミット済みの新しいバージョンを記録し、他のワーカーに伝える"""
+        version = self.remember(user_id, version)
+        with self._lock:
+            self._watcher.publish()
+        return version
+
+    def get(self, db: Session, user_id: int) -> int:
+        with self._lock:
+            if self._watcher.expired():
+                self._versions.clear()
+        version = self._versions.get(user_id)
+        if version is None:
+            row = db.get(LibraryVersion, user_id)
+            version = self.remember(user_id, row.version if row else 0)
+        return version
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+library_versions = LibraryVersionCache()
+
+def bump_library_version(db: Session, user_id: int, changes: List[tuple]) -> int:
+    """ライブラリのバージョンを1つ進めて変更履歴を追加する（コミットは呼び出し側で行う）
+
+    changes は (kind, object_id, op) のリスト。呼び出し側のトランザクションの中で
+    UPDATE によって加算するので、同時に更新されてもバージョンは重複しない。
+    """
+    statement = sqlite_insert(LibraryVersion).values(user_id=user_id, version=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[LibraryVersion.user_id],
+        set_={"version": LibraryVersion.version + 1},
+    ))
+    version = db.query(LibraryVersion.version).filter(LibraryVersion.user_id == user_id).scalar()
+    db.add_all([
+        LibraryChange(user_id=user_id, version=version, kind=kind, object_id=object_id, op=op)
+        for kind, object_id, op in changes
+    ])
+    return version
+
+def commit_library_change(db: Session, user_id: int, changes: List[tuple]) -> int:
+    """変更と同じトランザクションでバージョンを進めてコミットし、キャッシュに反映する"""
+    db.flush()
+    version = bump_library_version(db, user_id, changes)
+    db.commit()
+    return library_versions.changed(user_id, version)
+
+# 一覧レスポンスのETag
+def library_etag(user_id: int, version: int) -> str:
+    return f'W/"library-{user_id}-{version}"'
+
+# If-None-Match がETagに一致するか
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
 # =======================
 # CRUD関数
 # =======================
@@ -292,31 +1146,68 @@ def get_vrm_models(db: Session, user_id: int):
     return db.query(VRMModel).filter(VRMModel.user_id == user_id).all()
 
 # VRMモデルを作成する関数
-async def create_vrm_model(db: Session, name: str, vrm_file: UploadFile, user_id: int):
+async def create_vrm_model(db: Session, name: str, vrm_file: UploadFile, user_id: int,
+                           vrma_files: Optional[List[UploadFile]] = None):
+    """モデルと、一緒にアップロードされたアニメーションを登録する
+
+    すべてのファイルを検証しながら .part に書き込み、1つでも不正なら何も登録しない。
+    モデル・アニメーションの行とライブラリのバージョンは1回のコミットで登録する。
+    """
     # ユーザーごとのディレクトリを作成
     user_dir = os.path.join("uploads", str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
-    
+    anim_dir = os.path.join(user_dir, "animations")
+    os.makedirs(anim_dir, exist_ok=True)
+
     # ファイル名を一意にする
-    file_uuid = str(uuid.uuid4())
-    file_extension = os.path.splitext(vrm_file.filename)[1]
-    file_name = f"{file_uuid}{file_extension}"
-    file_path = os.path.join(user_dir, file_name)
-    
-    # ファイルを保存
-    with open(file_path, "wb") as buffer:
-        content = await vrm_file.read()
-        buffer.write(content)
-    
-    # URLパスとして使えるように \ を / に置換
-    url_path = "/" + file_path.replace("\\", "/")
-    
-    # データベースに登録
-    db_vrm = VRMModel(name=name, vrm_path=url_path, user_id=user_id)
-    db.add(db_vrm)
-    db.commit()
+    def unique_path(directory: str, upload_file: UploadFile) -> str:
+        return os.path.join(directory, f"{uuid.uuid4()}{os.path.splitext(upload_file.filename)[1]}")
+
+    staged: List[tuple] = []  # (.part のパス, 本来のパス)
+    try:
+        # ファイルを検証しながら保存（まだ公開しない）
+        file_path = unique_path(user_dir, vrm_file)
+        staged.append((await save_upload_file(vrm_file, file_path, VRM_MODEL_EXTENSIONS, publish=False), file_path))
+        animation_files = []
+        for vrma_file in vrma_files or []:
+            if vrma_file.filename:
+                anim_path = unique_path(anim_dir, vrma_file)
+                staged.append((
+                    await save_upload_file(vrma_file, anim_path, VRM_ANIMATION_EXTENSIONS, publish=False), anim_path
+                ))
+                # ファイル名からアニメーション名を抽出（拡張子を除く）
+                animation_files.append((Path(vrma_file.filename).stem, anim_path))
+        for part_path, final_path in staged:
+            os.replace(part_path, final_path)
+
+        # URLパスとして使えるように \ を / に置換
+        def url_path(path: str) -> str:
+            return "/" + path.replace("\\", "/")
+
+        # データベースに登録
+        db_vrm = VRMModel(name=name, vrm_path=url_path(file_path), user_id=user_id)
+        db.add(db_vrm)
+        db.flush()
+        animations = [
+            VRMAnimation(anim_name=anim_name, vrma_path=url_path(anim_path), model_id=db_vrm.id, user_id=user_id)
+            for anim_name, anim_path in animation_files
+        ]
+        db.add_all(animations)
+        db.flush()
+        commit_library_change(
+            db, user_id,
+            [("model", db_vrm.id, "upsert")] + [("animation", animation.id, "upsert") for animation in animations],
+        )
+    except BaseException:
+        db.rollback()
+        for part_path, final_path in staged:
+            for path in (part_path, final_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        raise
     db.refresh(db_vrm)
-    return db_vrm
+    return db_vrm, animations
 
 # VRMアニメーションを作成
 async def create_vrm_animation(db: Session, anim_name: str, vrma_file: UploadFile, model_id: int, user_id: int):
@@ -331,9 +1222,7 @@ async def create_vrm_animation(db: Session, anim_name: str, vrma_file: UploadFil
     file_path = os.path.join(user_dir, file_name)
     
     # ファイルを保存
-    with open(file_path, "wb") as buffer:
-        content = await vrma_file.read()
-        buffer.write(content)
+    await save_upload_file(vrma_file, file_path, VRM_ANIMATION_EXTENSIONS)
     
     # URLパスとして使えるように \ を / に置換
     url_path = "/" + file_path.replace("\\", "/")
@@ -346,10 +1235,47 @@ async def create_vrm_animation(db: Session, anim_name: str, vrma_file: UploadFil
         user_id=user_id
     )
     db.add(db_animation)
-    db.commit()
+    db.flush()
+    commit_library_change(db, user_id, [("animation", db_animation.id, "upsert")])
     db.refresh(db_animation)
     return db_animation
 
+# 特定のVRMモデル取得（所有者のものに限る）
+def get_vrm_model(db: Session, model_id: int, user_id: int):
+    return db.query(VRMModel).filter(VRMModel.id == model_id, VRMModel.user_id == user_id).first()
+
+# VRMモデル削除（アニメーションも同じトランザクションで削除し、削除対象のファイルパスを返す）
+def delete_vrm_model(db: Session, model_id: int, user_id: int):
+    db_vrm = get_vrm_model(db, model_id, user_id)
+    if db_vrm is None:
+        return None
+    file_paths = [db_vrm.vrm_path] + [animation.vrma_path for animation in db_vrm.animations]
+    changes = [("model", db_vrm.id, "delete")] + [
+        ("animation", animation.id, "delete") for animation in db_vrm.animations
+    ]
+    # animations と schedule_slots は cascade="all, delete-orphan" なので一緒に削除される
+    db.delete(db_vrm)
+    commit_library_change(db, user_id, changes)
+    schedule_cache.invalidate(user_id)
+    return file_paths
+
+# 特定のVRMアニメーション取得（所有者のものに限る）
+def get_vrm_animation(db: Session, animation_id: int, user_id: int):
+    return db.query(VRMAnimation).filter(
+        VRMAnimation.id == animation_id, VRMAnimation.user_id == user_id
+    ).first()
+
+# VRMアニメーション削除（削除対象のファイルパスを返す）
+def delete_vrm_animation(db: Session, animation_id: int, user_id: int):
+    db_animation = get_vrm_animation(db, animation_id, user_id)
+    if db_animation is None:
+        return None
+    file_paths = [db_animation.vrma_path]
+    db.delete(db_animation)
+    commit_library_change(db, user_id, [("animation", animation_id, "delete")])
+    schedule_cache.invalidate(user_id)
+    return file_paths
+
 # 背景画像をデータベースに保存する関数
 def create_background(db: Session, filename: str, path: str, user_id: int):
     """背景画像情報をデータベースに保存する"""
@@ -359,7 +1285,8 @@ def create_background(db: Session, filename: str, path: str, user_id: int):
         user_id=user_id
     )
     db.add(db_background)
-    db.commit()
+    db.flush()
+    commit_library_change(db, user_id, [("background", db_background.id, "upsert")])
     db.refresh(db_background)
     return db_background
 
@@ -368,6 +1295,108 @@ def get_backgrounds(db: Session, user_id: int):
     """ユーザーの背景画像一覧を取得する"""
     return db.query(Background).filter(Background.user_id == user_id).all()
 
+# =======================
+# 一覧レスポンス用の射影
+# =======================
+
+# 一覧系エンドポイントは、ORMオブジェクトの生成とPydanticでの1件ずつの検証を省き、
+# 必要な列だけを読んでレスポンスの形の辞書を直接組み立てる（DBの出力は信頼できるため）
+
+# ユーザーのモデル一覧（アニメーション込み）を辞書のリストで取得
+def list_vrm_model_dicts(db: Session, user_id: int) -> List[dict]:
+    models = {}
+    for row in db.query(VRMModel.id, VRMModel.name, VRMModel.vrm_path).filter(
+        VRMModel.user_id == user_id
+    ).order_by(VRMModel.id):
+        models[row.id] = {"id": row.id, "name": row.name, "vrm_path": row.vrm_path, "animations": []}
+    if models:
+        for row in db.query(
+            VRMAnimation.id, VRMAnimation.anim_name, VRMAnimation.vrma_path, VRMAnimation.model_id
+        ).join(VRMModel, VRMAnimation.model_id == VRMModel.id).filter(
+            VRMModel.user_id == user_id
+        ).order_by(VRMAnimation.id):
+            models[row.model_id]["animations"].append(
+                {"id": row.id, "anim_name": row.anim_name, "vrma_path": row.vrma_path}
+            )
+    return list(models.values())
+
+# 背景画像のレスポンス用の列
+BACKGROUND_COLUMNS = (
+    Background.id, Background.filename, Background.path, Background.optimized_path,
+    Background.frame_count, Background.duration_ms, Background.width, Background.height,
+)
+
+# 背景画像（またはその列の行）を辞書に変換
+def background_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "filename": row.filename,
+        "path": row.path,
+        "optimized_path": row.optimized_path,
+        "frame_count": row.frame_count,
+        "duration_ms": row.duration_ms,
+        "width": row.width,
+        "height": row.height,
+    }
+
+# ユーザーの背景画像一覧を辞書のリストで取得
+def list_background_dicts(db: Session, user_id: int) -> List[dict]:
+    return [
+        background_to_dict(row)
+        for row in db.query(*BACKGROUND_COLUMNS).filter(Background.user_id == user_id).order_by(Background.id)
+    ]
+
+# ユーザー情報（モデル一覧込み）を辞書で取得
+def user_to_dict(db: Session, user: User) -> dict:
+    return {
+        "email": user.email,
+        "id": user.id,
+        "is_active": user.is_active,
+        "vrm_models": list_vrm_model_dicts(db, user.id),
+    }
+
+# ライブラリの差分（指定バージョンより後の変更。同じオブジェクトの変更は最後のものだけ）
+def get_library_changes(db: Session, user_id: int, since: int) -> List[dict]:
+    latest = {}
+    for change in db.query(LibraryChange).filter(
+        LibraryChange.user_id == user_id, LibraryChange.version > since
+    ).order_by(LibraryChange.id):
+        latest[(change.kind, change.object_id)] = change
+    ids = {"model": [], "animation": [], "background": []}
+    for (kind, object_id), change in latest.items():
+        if change.op == "upsert":
+            ids[kind].append(object_id)
+    data = {}
+    if ids["model"]:
+        for row in db.query(VRMModel.id, VRMModel.name, VRMModel.vrm_path).filter(
+            VRMModel.user_id == user_id, VRMModel.id.in_(ids["model"])
+        ):
+            data[("model", row.id)] = {"id": row.id, "name": row.name, "vrm_path": row.vrm_path}
+    if ids["animation"]:
+        for row in db.query(
+            VRMAnimation.id, VRMAnimation.anim_name, VRMAnimation.vrma_path, VRMAnimation.model_id
+        ).filter(VRMAnimation.user_id == user_id, VRMAnimation.id.in_(ids["animation"])):
+            data[("animation", row.id)] = {
+                "id": row.id, "anim_name": row.anim_name, "vrma_path": row.vrma_path, "model_id": row.model_id
+            }
+    if ids["background"]:
+        for row in db.query(*BACKGROUND_COLUMNS).filter(
+            Background.user_id == user_id, Background.id.in_(ids["background"])
+        ):
+            data[("background", row.id)] = background_to_dict(row)
+    changes = []
+    for key, change in sorted(latest.items(), key=lambda item: item[1].id):
+        item = data.get(key)
+        changes.append({
+            "version": change.version,
+            "kind": change.kind,
+            "id": change.object_id,
+            # 変更後に削除されていた場合も削除として返す
+            "op": "upsert" if item is not None else "delete",
+            "data": item,
+        })
+    return changes
+
 # 特定の背景画像取得
 def get_background(db: Session, background_id: int):
     return db.query(Background).filter(Background.id == background_id).first()
@@ -376,16 +1405,71 @@ def get_background(db: Session, background_id: int):
 def delete_background(db: Session, background_id: int):
     db_background = get_background(db, background_id)
     if db_background:
-        # ファイルシステムからも削除（先頭の / を削除して相対パスに変換）
-        file_path = db_background.path.lstrip('/')
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        file_paths = [path for path in (db_background.path, db_background.optimized_path) if path]
         # データベースから削除
+        user_id = db_background.user_id
         db.delete(db_background)
-        db.commit()
+        commit_library_change(db, user_id, [("background", background_id, "delete")])
+        schedule_cache.invalidate(user_id)
+        # ファイルはコールド層のコピーも含めてバックグラウンドで削除する
+        file_removal_queue.enqueue(file_paths)
         return True
     return False
 
+# スケジュール枠をAPI用の辞書に変換
+def schedule_slot_to_dict(slot: ScheduleSlot) -> dict:
+    recurring = slot.days_of_week is not None
+    return {
+        "id": slot.id,
+        "model_id": slot.model_id,
+        "animation_id": slot.animation_id,
+        "background_id": slot.background_id,
+        "priority": slot.priority,
+        "days_of_week": [day for day in range(7) if slot.days_of_week & (1 << day)] if recurring else None,
+        "start_time": minute_to_time(slot.start_minute) if recurring else None,
+        "end_time": minute_to_time(slot.end_minute) if recurring else None,
+        "starts_at": slot.starts_at,
+        "ends_at": slot.ends_at,
+    }
+
+# ユーザーのスケジュール枠一覧を取得
+def get_schedule_slots(db: Session, user_id: int):
+    return db.query(ScheduleSlot).filter(ScheduleSlot.user_id == user_id).order_by(ScheduleSlot.id).all()
+
+# スケジュール枠を作成
+def create_schedule_slot(db: Session, slot: ScheduleSlotCreate, user_id: int):
+    db_slot = ScheduleSlot(
+        user_id=user_id,
+        model_id=slot.model_id,
+        animation_id=slot.animation_id,
+        background_id=slot.background_id,
+        priority=slot.priority,
+    )
+    if slot.days_of_week is not None:
+        db_slot.days_of_week = sum(1 << day for day in set(slot.days_of_week))
+        db_slot.start_minute = slot.start_time.hour * 60 + slot.start_time.minute
+        db_slot.end_minute = slot.end_time.hour * 60 + slot.end_time.minute
+    else:
+        db_slot.starts_at = to_local_naive(slot.starts_at)
+        db_slot.ends_at = to_local_naive(slot.ends_at)
+    db.add(db_slot)
+    db.commit()
+    db.refresh(db_slot)
+    schedule_cache.invalidate(user_id)
+    return db_slot
+
+# スケジュール枠を削除
+def delete_schedule_slot(db: Session, slot_id: int, user_id: int):
+    db_slot = db.query(ScheduleSlot).filter(
+        ScheduleSlot.id == slot_id, ScheduleSlot.user_id == user_id
+    ).first()
+    if db_slot is None:
+        return False
+    db.delete(db_slot)
+    db.commit()
+    schedule_cache.invalidate(user_id)
+    return True
+
 # =======================
 # 初期化関数
 # =======================
@@ -419,30 +1503,1874 @@ if not os.path.exists(default_bg_path):
 # データベースの初期化
 def init_db():
     inspector = inspect(engine)
-    # テーブルが存在しない場合のみ作成
-    if not inspector.has_table("users"):
-        Base.metadata.create_all(bind=engine)
-    else:
-        print("データベースは既に初期化されています。テーブルの再作成はスキップします。")
+    if inspector.has_table("users"):
+        print("データベースは既に初期化されています。不足しているテーブルと列のみ作成します。")
+    # create_all は既存のテーブルを作り直さず、存在しないテーブルだけを作成する
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+# 既存のテーブルに、後から追加したNULL許容の列を追加する
+def add_missing_columns():
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+                    print(f"列を追加しました: {table.name}.{column.name}")
 
 # 初期化関数を呼び出す
 init_db()
 
+# =======================
+# アップロードファイル整合性チェック
+# =======================
+
+# アップロードファイルの保存先（URLの /uploads/... に対応）
+UPLOAD_ROOT = "uploads"
+# 孤立ファイルの隔離先（/uploads で公開されないようにアップロードディレクトリの外に置く）
+QUARANTINE_ROOT = os.getenv("QUARANTINE_DIR", "quarantine")
+# 1バッチで処理する最大件数と時間（秒）
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+RECONCILE_TIME_BUDGET = float(os.getenv("RECONCILE_TIME_BUDGET", "0.05"))
+# バッチ間の待機時間（秒）と、1周したあとの待機時間（秒）
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "1"))
+RECONCILE_PASS_INTERVAL = float(os.getenv("RECONCILE_PASS_INTERVAL", "600"))
+# 書き込み途中・コミット前のファイルを孤立扱いしないための猶予（秒）
+ORPHAN_GRACE_SECONDS = int(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))
+# 隔離したファイルを完全に削除するまでの保持期間（秒）
+QUARANTINE_RETENTION_SECONDS = int(os.getenv("QUARANTINE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# URLパス（/uploads/1/xxx.vrm）をファイルパス（uploads/1/xxx.vrm）に変換
+def url_path_to_file_path(url_path: str) -> str:
+    return url_path.lstrip('/')
+
+class UploadReconciler:
+    """DBの参照パスとuploads/配下のファイルを少しずつ突き合わせる
+
+    1周（パス）の開始時に vrm_path / vrma_path / path の参照インデックスを作り、
+    DB行の存在確認とファイルツリーの走査をバッチ単位（件数と時間の上限付き）で進める。
+    参照されていないファイルは隔離ディレクトリへ移動し、保持期間を過ぎたら削除する。
+    """
+
+    def __init__(self, root: str = UPLOAD_ROOT, quarantine_root: str = QUARANTINE_ROOT):
+        self.root = root
+        self.quarantine_root = quarantine_root
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._work = None
+        self._referenced: set = set()
+        self._current: dict = {}
+        self.report: dict = {
+            "last_pass_completed_at": None,
+            "scanned_files": 0,
+            "quarantined": [],
+            "purged": 0,
+            "dangling": [],
+        }
+
+    # 参照インデックスを作成（パス列だけを読む）
+    def _load_rows(self):
+        db = SessionLocal()
+        try:
+            rows = [("model", r.id, r.user_id, r.vrm_path)
+                    for r in db.query(VRMModel.id, VRMModel.user_id, VRMModel.vrm_path)]
+            rows += [("animation", r.id, r.user_id, r.vrma_path)
+                     for r in db.query(VRMAnimation.id, VRMAnimation.user_id, VRMAnimation.vrma_path)]
+            rows += [("background", r.id, r.user_id, r.path)
+                     for r in db.query(Background.id, Background.user_id, Background.path)]
+            rows += [("background_optimized", r.id, r.user_id, r.optimized_path)
+                     for r in db.query(Background.id, Background.user_id, Background.optimized_path).filter(
+                         Background.optimized_path.isnot(None))]
+        finally:
+            db.close()
+        return rows
+
+    # 1周分の作業を1件ずつ返すジェネレータ
+    def _iter_work(self):
+        rows = self._load_rows()
+        self._referenced = {os.path.normpath(url_path_to_file_path(path)) for _, _, _, path in rows}
+        for row in rows:
+            yield ("row", row)
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                yield ("file", os.path.normpath(os.path.join(dirpath, filename)))
+        for dirpath, _, filenames in os.walk(tiered_storage.cold_root):
+            for filename in filenames:
+                yield ("cold", os.path.normpath(os.path.join(dirpath, filename)))
+
+    def _check_row(self, row):
+        kind, row_id, user_id, path = row
+        file_path = url_path_to_file_path(path)
+        if not tiered_storage.exists(file_path):
+            self._current["dangling"].append(
+                {"kind": kind, "id": row_id, "user_id": user_id, "path": path}
+            )
+
+    def _check_file(self, file_path: str, now: float):
+        self._current["scanned_files"] += 1
+        if file_path in self._referenced:
+            return
+        try:
+            if now - os.path.getmtime(file_path) < ORPHAN_GRACE_SECONDS:
+                return
+            self._quarantine(file_path, os.path.relpath(file_path, self.root))
+        except OSError as e:
+            print(f"孤立ファイルの隔離に失敗しました: {file_path} ({e})")
+
+    # コールド層のファイルは、元のパス（.gz を除いたもの）が参照されていなければ孤立扱い
+    def _check_cold_file(self, file_path: str, now: float):
+        relative = os.path.relpath(file_path, tiered_storage.cold_root)
+        originals = [relative] + ([relative[:-len(".gz")]] if relative.endswith(".gz") else [])
+        if any(os.path.normpath(os.path.join(self.root, original)) in self._referenced for original in originals):
+            return
+        try:
+            # コールド層のファイルの更新時刻は元のファイルのものなので、移動した時刻（ctime）で判定する
+            if now - os.stat(file_path).st_ctime < ORPHAN_GRACE_SECONDS:
+                return
+            self._quarantine(file_path, os.path.join("cold", relative))
+        except OSError as e:
+            print(f"孤立ファイルの隔離に失敗しました: {file_path} ({e})")
+
+    def _quarantine(self, file_path: str, relative: str):
+        destination = os.path.join(self.quarantine_root, relative)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(file_path, destination)
+        # 保持期間は隔離した時刻から数える
+        os.utime(destination, None)
+        self._current["quarantined"].append(file_path)
+
+    # 保持期間を過ぎた隔離ファイルを削除
+    def _purge_quarantine(self, now: float) -> int:
+        purged = 0
+        for dirpath, _, filenames in os.walk(self.quarantine_root):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.path.getmtime(file_path) >= QUARANTINE_RETENTION_SECONDS:
+                        os.remove(file_path)
+                        purged += 1
+                except OSError:
+                    pass
+        return purged
+
+    def step(self) -> bool:
+        """1バッチ分だけ処理する。1周が完了したらTrueを返す"""
+        with self._lock:
+            if self._work is None:
+                self._work = self._iter_work()
+                self._current = {"scanned_files": 0, "quarantined": [], "dangling": []}
+            deadline = time.monotonic() + RECONCILE_TIME_BUDGET
+            now = time.time()
+            for _ in range(RECONCILE_BATCH_SIZE):
+                item = next(self._work, None)
+                if item is None:
+                    self._current["purged"] = self._purge_quarantine(now)
+                    self._current["last_pass_completed_at"] = datetime.utcnow().isoformat()
+                    self.report = self._current
+                    self._work = None
+                    return True
+                kind, value = item
+                if kind == "row":
+                    self._check_row(value)
+                elif kind == "cold":
+                    self._check_cold_file(value, now)
+                else:
+                    self._check_file(value, now)
+                if time.monotonic() >= deadline:
+                    break
+            return False
+
+    def run_pass(self):
+        """1周分をまとめて実行する（メンテナンス用）"""
+        while not self.step():
+            pass
+        return self.report
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                completed = self.step()
+            except Exception as e:
+                print(f"Reconcile error: {str(e)}\n{traceback.format_exc()}")
+                with self._lock:
+                    self._work = None
+                completed = True
+            self._stop.wait(RECONCILE_PASS_INTERVAL if completed else RECONCILE_INTERVAL)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="upload-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+upload_reconciler = UploadReconciler()
+
+# =======================
+# ファイル削除キュー
+# =======================
+
+# 1回の処理でまとめて削除するファイル数
+FILE_REMOVAL_BATCH_SIZE = int(os.getenv("FILE_REMOVAL_BATCH_SIZE", "32"))
+
+class FileRemovalQueue:
+    """DB行の削除後にファイルをバックグラウンドでまとめて削除するキュー
+
+    SDカードへの unlink をリクエスト処理から切り離し、削除APIはすぐに応答できるようにする。
+    """
+
+    def __init__(self, batch_size: int = FILE_REMOVAL_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, url_paths: List[str]):
+        for url_path in url_paths:
+            self._queue.put(url_path_to_file_path(url_path))
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="file-removal", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> List[str]:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            for file_path in batch:
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"ファイルの削除に失敗しました: {file_path} ({e})")
+                try:
+                    # コールド層に移されていた場合はそちらも削除する
+                    tiered_storage.remove_cold(tiered_storage.relative(file_path))
+                except OSError as e:
+                    print(f"コールド層のファイルの削除に失敗しました: {file_path} ({e})")
+                finally:
+                    self._queue.task_done()
+
+    def join(self):
+        """キューに積まれたファイルがすべて削除されるまで待つ"""
+        self._queue.join()
+
+file_removal_queue = FileRemovalQueue()
+
+# =======================
+# 静的アセット配信
+# =======================
+
+# メモリに保持するアセットの合計サイズ上限（バイト）
+HOT_ASSET_CACHE_BYTES = int(os.getenv("HOT_ASSET_CACHE_BYTES", str(64 * 1024 * 1024)))
+# この大きさ以下のファイルをメモリキャッシュの対象にする（バイト）
+HOT_ASSET_MAX_FILE_SIZE = int(os.getenv("HOT_ASSET_MAX_FILE_SIZE", str(8 * 1024 * 1024)))
+# 大きなファイルをストリーミングするときの1回の読み込みサイズ（バイト）
+LARGE_ASSET_CHUNK_SIZE = int(os.getenv("LARGE_ASSET_CHUNK_SIZE", str(1024 * 1024)))
+
+class HotAssetCache:
+    """よく配信する小さなアセットをメモリに保持するLRUキャッシュ
+
+    上限は合計バイト数で管理する。エントリはファイルの更新時刻とサイズで検証し、
+    ETag には内容のハッシュを使う（内容が同じなら再読み込み後も同じETagになる）。
+    """
+
+    def __init__(self, max_bytes: int = HOT_ASSET_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(stat_result: os.stat_result):
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    def peek(self, full_path, stat_result: os.stat_result):
+        """キャッシュ済みで内容が変わっていなければ (etag, data) を返す（I/Oなし）"""
+        key = str(full_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self._signature(stat_result):
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def load(self, full_path):
+        """ファイルを読み込んでキャッシュに登録し、(etag, data) を返す"""
+        key = str(full_path)
+        with open(full_path, "rb") as f:
+            signature = self._signature(os.fstat(f.fileno()))
+            data = f.read()
+        etag = hashlib.sha1(data).hexdigest()
+        if len(data) > self.max_bytes:
+            return etag, data
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[2])
+            self._entries[key] = (signature, etag, data)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return etag, data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+hot_asset_cache = HotAssetCache()
+
+class HotAssetResponse(FileResponse):
+    """メモリキャッシュから返すファイルレスポンス（未キャッシュならここで読み込む）"""
+
+    def __init__(self, path, stat_result: os.stat_result, method: Optional[str] = None,
+                 entry: Optional[tuple] = None, headers: Optional[dict] = None):
+        self.entry = entry
+        headers = dict(headers or {})
+        if entry is not None:
+            headers["etag"] = entry[0]
+        super().__init__(path, stat_result=stat_result, method=method, headers=headers)
+
+    async def __call__(self, scope, receive, send):
+        if self.entry is None:
+            self.entry = await anyio.to_thread.run_sync(hot_asset_cache.load, self.path)
+            self.headers["etag"] = self.entry[0]
+            self.headers["content-length"] = str(len(self.entry[1]))
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        body = b"" if self.send_header_only else self.entry[1]
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+class LargeAssetResponse(FileResponse):
+    """大きなファイル用のレスポンス（大きめのチャンクで読み出して送り、チャンクごとの処理回数を減らす）
+
+    チャンクサイズによるCPU時間の違いは bench_asset_serving.py で測定できる。
+    """
+
+    chunk_size = LARGE_ASSET_CHUNK_SIZE
+
+# 内容が変わらないURL（フィンガープリント付きのファイル名など）に付けるCache-Control
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# フィンガープリントに使うハッシュの桁数
+STATIC_FINGERPRINT_LENGTH = 12
+
+class StaticFingerprints:
+    """静的ファイルの内容のハッシュをファイル名に埋め込んだURLを管理する
+
+    起動時に static 以下のファイルをハッシュし、"js/main.js" ⇔ "js/main.<hash>.js" の対応を作る。
+    内容が変わればURLも変わるので、フィンガープリント付きのURLは immutable として配信できる。
+    実行時に作られるファイル（uploads 以下）は対象外。
+    """
+
+    def __init__(self, directory: str, exclude: tuple = ("uploads",)):
+        self.directory = directory
+        self.exclude = exclude
+        self._urls: dict = {}
+        self._originals: dict = {}
+        self.built = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprinted_name(path: str, digest: str) -> str:
+        stem, extension = os.path.splitext(path)
+        return f"{stem}.{digest[:STATIC_FINGERPRINT_LENGTH]}{extension}"
+
+    def build(self):
+        urls, originals = {}, {}
+        for root, dirs, files in os.walk(self.directory):
+            if root == self.directory:
+                dirs[:] = [d for d in dirs if d not in self.exclude]
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                digest = hashlib.sha1()
+                with open(full_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(LARGE_ASSET_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                fingerprinted = self._fingerprinted_name(relative, digest.hexdigest())
+                urls[relative] = fingerprinted
+                originals[fingerprinted] = relative
+        with self._lock:
+            self._urls, self._originals = urls, originals
+            self.built = True
+
+    def _ensure_built(self):
+        if not self.built:
+            self.build()
+
+    def url_for(self, path: str) -> str:
+        """テンプレートから参照するURL（対象外のファイルは元の名前のまま）"""
+        self._ensure_built()
+        path = path.lstrip("/")
+        return f"/{self.directory}/{self._urls.get(path, path)}"
+
+    def resolve(self, path: str) -> Optional[str]:
+        """フィンガープリント付きのパスなら元のパスを返す"""
+        self._ensure_built()
+        return self._originals.get(path)
+
+static_fingerprints = StaticFingerprints("static")
+
+class AssetStaticFiles(StaticFiles):
+    """小さなファイルはメモリキャッシュ、大きなファイルは大きめのチャンクで配信するStaticFiles
+
+    fingerprints を渡すとフィンガープリント付きのパスを元のファイルに対応付けて immutable で配信する。
+    immutable=True はマウント全体のファイルが作成後に書き換わらない場合（アップロード先など）に使う。
+    tiers を渡すとアクセスを記録し、見つからないファイルはコールド層から戻して配信する。
+    """
+
+    def __init__(self, *args, fingerprints: Optional[StaticFingerprints] = None, immutable: bool = False,
+                 tiers: Optional["TieredStorage"] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fingerprints = fingerprints
+        self.immutable = immutable
+        self.tiers = tiers
+
+    async def get_response(self, path: str, scope):
+        original = self.fingerprints.resolve(path.replace(os.sep, "/")) if self.fingerprints else None
+        try:
+            response = await super().get_response(original or path, scope)
+        except StarletteHTTPException as exc:
+            if exc.status_code != 404 or self.tiers is None:
+                raise
+            response = await anyio.to_thread.run_sync(self.tiers.promotion_response, path, scope["method"])
+            if response is None:
+                raise
+        if self.tiers is not None and response.status_code in (200, 304):
+            self.tiers.record_access(path.replace(os.sep, "/"))
+        if (original or self.immutable) and response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200):
+        method = scope["method"]
+        request_headers = Headers(scope=scope)
+        if status_code == 200 and stat_result.st_size <= HOT_ASSET_MAX_FILE_SIZE:
+            entry = hot_asset_cache.peek(full_path, stat_result)
+            response = HotAssetResponse(full_path, stat_result, method=method, entry=entry)
+            if entry is not None and self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+        response = LargeAssetResponse(full_path, status_code=status_code, stat_result=stat_result, method=method)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+# =======================
+# トップページ
+# =======================
+
+# この大きさ以上のレスポンスだけ圧縮版を用意する（バイト）
+INDEX_GZIP_MIN_SIZE = 512
+
+class RenderedPageCache:
+    """描画済みのテンプレートを圧縮版と一緒にメモリに保持する
+
+    テンプレートはリクエストに依存しないので、起動後に1度だけ描画すればよい。
+    """
+
+    def __init__(self):
+        self._pages: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> dict:
+        page = self._pages.get(name)
+        if page is None:
+            with self._lock:
+                page = self._pages.get(name)
+                if page is None:
+                    page = self._render(name)
+                    self._pages[name] = page
+        return page
+
+    @staticmethod
+    def _render(name: str) -> dict:
+        body = templates.get_template(name).render().encode("utf-8")
+        return {
+            "body": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0) if len(body) >= INDEX_GZIP_MIN_SIZE else None,
+            "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        }
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+rendered_pages = RenderedPageCache()
+
+def preload_static_state():
+    """静的ファイルのフィンガープリントとトップページを用意する
+
+    マルチワーカーではfork前に親プロセスで実行し、ワーカーはコピーオンライトで共有する。
+    """
+    static_fingerprints.build()
+    rendered_pages.clear()
+    rendered_pages.get("index.html")
+
+# Accept-Encoding で gzip が受け入れられているか（q=0 は拒否）
+def accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+def cached_page_response(request: Request, name: str) -> Response:
+    page = rendered_pages.get(name)
+    headers = {"ETag": page["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), page["etag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = page["body"]
+    if page["gzip"] is not None and accepts_gzip(request.headers.get("accept-encoding", "")):
+        body = page["gzip"]
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="text/html", headers=headers)
+
+# =======================
+# スケジュール
+# =======================
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# 0時からの分を時刻に変換
+def minute_to_time(minute: int) -> clock_time:
+    return clock_time(hour=minute // 60, minute=minute % 60)
+
+# スケジュールはサーバーのローカル時刻（タイムゾーンなし）で扱う
+def to_local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+class IntervalIndex:
+    """重なり合う区間を優先度で解決し、重ならない区間の列として保持するインデックス
+
+    区間は (start, end, priority, tie_breaker, value) で与える。
+    構築時に区間の境界で掃引して各範囲の勝者を決めておくので、検索は二分探索の O(log n) で済む。
+    """
+
+    def __init__(self, intervals):
+        self.starts: list = []
+        self.ends: list = []
+        self.values: list = []
+        boundaries = sorted({point for start, end, *_ in intervals for point in (start, end)})
+        ordered = sorted(intervals, key=lambda interval: interval[0])
+        active: list = []
+        position = 0
+        for left, right in zip(boundaries, boundaries[1:]):
+            while position < len(ordered) and ordered[position][0] <= left:
+                start, end, priority, tie_breaker, value = ordered[position]
+                heapq.heappush(active, (-priority, -tie_breaker, end, position, value))
+                position += 1
+            # 終了済みの区間を取り除き、残った最優先の区間をこの範囲の勝者にする
+            while active and active[0][2] <= left:
+                heapq.heappop(active)
+            if not active:
+                continue
+            value = active[0][4]
+            if self.values and self.ends[-1] == left and self.values[-1] is value:
+                self.ends[-1] = right
+            else:
+                self.starts.append(left)
+                self.ends.append(right)
+                self.values.append(value)
+
+    def lookup(self, point):
+        index = bisect_right(self.starts, point) - 1
+        if index >= 0 and point < self.ends[index]:
+            return self.values[index]
+        return None
+
+class CompiledSchedule:
+    """1ユーザー分のスケジュールをコンパイルしたもの（繰り返し枠は1週間分、1回限りの枠は日時で索引）"""
+
+    def __init__(self, entries: List[dict]):
+        weekly = []
+        once = []
+        for entry in entries:
+            slot = entry["slot"]
+            if slot["days_of_week"] is not None:
+                start_minute = slot["start_minute"]
+                end_minute = slot["end_minute"]
+                length = (end_minute - start_minute) % MINUTES_PER_DAY or MINUTES_PER_DAY
+                for day in slot["days_of_week"]:
+                    start = day * MINUTES_PER_DAY + start_minute
+                    end = start + length
+                    # 日曜から月曜にまたがる枠は週の先頭に折り返す
+                    if end > MINUTES_PER_WEEK:
+                        weekly.append((start, MINUTES_PER_WEEK, slot["priority"], slot["id"], entry))
+                        weekly.append((0, end - MINUTES_PER_WEEK, slot["priority"], slot["id"], entry))
+                    else:
+                        weekly.append((start, end, slot["priority"], slot["id"], entry))
+            elif slot["starts_at"] is not None and slot["ends_at"] is not None:
+                once.append((slot["starts_at"], slot["ends_at"], slot["priority"], slot["id"], entry))
+        self.weekly = IntervalIndex(weekly)
+        self.once = IntervalIndex(once)
+
+    def resolve(self, at: datetime) -> Optional[dict]:
+        """指定日時に表示すべきエントリを返す（同じ優先度なら1回限りの枠を優先）"""
+        minute_of_week = at.weekday() * MINUTES_PER_DAY + at.hour * 60 + at.minute + at.second / 60
+        weekly_entry = self.weekly.lookup(minute_of_week)
+        once_entry = self.once.lookup(at)
+        if once_entry is None:
+            return weekly_entry
+        if weekly_entry is None or once_entry["slot"]["priority"] >= weekly_entry["slot"]["priority"]:
+            return once_entry
+        return weekly_entry
+
+# スケジュール枠と参照先のパスを、キャッシュに保持できる辞書として読み込む
+def load_schedule_entries(db: Session, user_id: int) -> List[dict]:
+    rows = db.query(
+        ScheduleSlot, VRMModel.name, VRMModel.vrm_path, VRMAnimation.anim_name, VRMAnimation.vrma_path,
+        Background.path, Background.optimized_path,
+    ).join(VRMModel, ScheduleSlot.model_id == VRMModel.id).outerjoin(
+        VRMAnimation, ScheduleSlot.animation_id == VRMAnimation.id
+    ).outerjoin(
+        Background, ScheduleSlot.background_id == Background.id
+    ).filter(ScheduleSlot.user_id == user_id).all()
+    entries = []
+    for slot, model_name, vrm_path, anim_name, vrma_path, background_path, background_optimized_path in rows:
+        entries.append({
+            "slot": {
+                "id": slot.id,
+                "priority": slot.priority,
+                "days_of_week": (
+                    [day for day in range(7) if slot.days_of_week & (1 << day)]
+                    if slot.days_of_week is not None else None
+                ),
+                "start_minute": slot.start_minute,
+                "end_minute": slot.end_minute,
+                "starts_at": slot.starts_at,
+                "ends_at": slot.ends_at,
+            },
+            "slot_id": slot.id,
+            "model_id": slot.model_id,
+            "model_name": model_name,
+            "vrm_path": vrm_path,
+            "animation_id": slot.animation_id,
+            "anim_name": anim_name,
+            "vrma_path": vrma_path,
+            "background_id": slot.background_id,
+            "background_path": background_path,
+            # GIF背景を変換したWebP（表示端末はあればこちらを使う）
+            "background_optimized_path": background_optimized_path,
+            "priority": slot.priority,
+        })
+    return entries
+
+class ScheduleCache:
+    """ユーザーごとのコンパイル済みスケジュールのキャッシュ（スケジュール変更時に破棄する）
+
+    コンパイルはロックの外で行うので、開始前の世代を覚えておき、コンパイル中に
+    invalidate（他のワーカーからの無効化を含む）があった場合は結果を保存しない。
+    """
+
+    def __init__(self):
+        self._compiled: dict = {}
+        self._generations: dict = {}  # user_id -> invalidate された回数
+        self._epoch = 0  # 他のワーカーの無効化で全体を破棄した回数
+        self._lock = threading.Lock()
+        self._watcher = GenerationWatcher(invalidation_bus, "schedule")
+
+    def _check_expired(self):
+        # self._lock を保持して呼ぶ
+        if self._watcher.expired():
+            self._compiled.clear()
+            self._epoch += 1
+
+    def get(self, db: Session, user_id: int) -> CompiledSchedule:
+        with self._lock:
+            self._check_expired()
+            compiled = self._compiled.get(user_id)
+            generation = (self._epoch, self._generations.get(user_id, 0))
+        if compiled is None:
+            compiled = CompiledSchedule(load_schedule_entries(db, user_id))
+            with self._lock:
+                self._check_expired()
+                if (self._epoch, self._generations.get(user_id, 0)) == generation:
+                    self._compiled[user_id] = compiled
+        return compiled
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._compiled.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._watcher.publish()
+
+schedule_cache = ScheduleCache()
+
+# =======================
+# 定期実行ワーカー
+# =======================
+
+class PeriodicWorker:
+    """指定した関数を一定間隔でバックグラウンドスレッドから呼び出す（run_on_stop なら停止時にも1回呼ぶ）"""
+
+    def __init__(self, name: str, interval: float, func, run_on_stop: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_on_stop = run_on_stop
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run_once(self):
+        try:
+            self.func()
+        except Exception as e:
+            print(f"{self.name} error: {str(e)}\n{traceback.format_exc()}")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._run_once()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        if self.run_on_stop:
+            self._run_once()
+
+# =======================
+# 表示端末の管理
+# =======================
+
+# 端末がハートビートを送る間隔（秒）。この間隔の数倍途絶えたらオフライン扱い
+HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", "10"))
+DEVICE_OFFLINE_AFTER = int(os.getenv("DEVICE_OFFLINE_AFTER", str(HEARTBEAT_INTERVAL * 3)))
+# メモリ上のハートビートをDBへ書き込む間隔（秒）と、1文でまとめて書き込む行数
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "15"))
+HEARTBEAT_FLUSH_BATCH_SIZE = 100
+# ユーザーごとに登録できる端末数の上限（新しい device_key ごとにメモリとDBの行が増えるため）
+MAX_DEVICES_PER_USER = int(os.getenv("MAX_DEVICES_PER_USER", "100"))
+
+class HeartbeatTable:
+    """端末のハートビートをメモリ上の表に集約し、変更分だけを定期的にまとめてDBへ書き込む
+
+    ハートビートごとのコミットは行わず、同じ端末からの複数のハートビートは最後の1件に合体する。
+    一覧（フリート状態）はこの表から返すので、DBを読まない。
+    マルチワーカーでは他のワーカーが受けたハートビートをDBから取り込んでから返す。
+    """
+
+    def __init__(self):
+        self._devices: dict = {}  # user_id -> {device_key: 状態の辞書}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+
+    def load(self, db: Session, user_id: Optional[int] = None):
+        """登録済みの端末を読み込む（起動時は全件、マルチワーカーではユーザー単位で取り込む）
+
+        手元の状態の方が新しい端末は上書きしない。
+        """
+        query = db.query(Device)
+        if user_id is not None:
+            query = query.filter(Device.user_id == user_id)
+        with self._lock:
+            for device in query:
+                devices = self._devices.setdefault(device.user_id, {})
+                entry = devices.get(device.device_key)
+                if entry is not None and entry["last_seen_at"] is not None and (
+                    device.last_seen_at is None or entry["last_seen_at"] >= device.last_seen_at
+                ):
+                    continue
+                devices[device.device_key] = {
+                    "device_key": device.device_key,
+                    "name": device.name if entry is None or device.name is not None else entry["name"],
+                    "model_id": device.current_model_id,
+                    "background_id": device.current_background_id,
+                    "state": device.state,
+                    "last_seen_at": device.last_seen_at,
+                }
+
+    def known(self, user_id: int, device_key: str) -> bool:
+        with self._lock:
+            return device_key in self._devices.get(user_id, {})
+
+    def record(self, user_id: int, heartbeat: DeviceHeartbeat) -> bool:
+        """ハートビートを記録する（未登録の端末で上限に達している場合は記録せずに False を返す）"""
+        now = datetime.utcnow()
+        with self._lock:
+            devices = self._devices.setdefault(user_id, {})
+            entry = devices.get(heartbeat.device_key)
+            if entry is None:
+                if len(devices) >= MAX_DEVICES_PER_USER:
+                    return False
+                entry = devices[heartbeat.device_key] = {"device_key": heartbeat.device_key, "name": None}
+            if heartbeat.name is not None:
+                entry["name"] = heartbeat.name
+            entry["model_id"] = heartbeat.model_id
+            entry["background_id"] = heartbeat.background_id
+            entry["state"] = heartbeat.state
+            entry["last_seen_at"] = now
+            self._dirty.add((user_id, heartbeat.device_key))
+        return True
+
+    def fleet(self, user_id: int) -> List[dict]:
+        threshold = datetime.utcnow() - timedelta(seconds=DEVICE_OFFLINE_AFTER)
+        with self._lock:
+            entries = [dict(entry) for entry in self._devices.get(user_id, {}).values()]
+        for entry in entries:
+            entry["online"] = entry["last_seen_at"] is not None and entry["last_seen_at"] >= threshold
+        return sorted(entries, key=lambda entry: entry["device_key"])
+
+    def flush(self) -> int:
+        """変更された端末の状態をまとめてDBへ書き込む（1トランザクション）"""
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = set()
+            rows = [
+                {
+                    "user_id": user_id,
+                    "device_key": device_key,
+                    "name": self._devices[user_id][device_key]["name"],
+                    "current_model_id": self._devices[user_id][device_key]["model_id"],
+                    "current_background_id": self._devices[user_id][device_key]["background_id"],
+                    "state": self._devices[user_id][device_key]["state"],
+                    "last_seen_at": self._devices[user_id][device_key]["last_seen_at"],
+                }
+                for user_id, device_key in dirty
+            ]
+        if not rows:
+            return 0
+        db = SessionLocal()
+        try:
+            for offset in range(0, len(rows), HEARTBEAT_FLUSH_BATCH_SIZE):
+                statement = sqlite_insert(Device).values(rows[offset:offset + HEARTBEAT_FLUSH_BATCH_SIZE])
+                statement = statement.on_conflict_do_update(
+                    index_elements=[Device.user_id, Device.device_key],
+                    set_={
+                        "name": func.coalesce(statement.excluded.name, Device.name),
+                        "current_model_id": statement.excluded.current_model_id,
+                        "current_background_id": statement.excluded.current_background_id,
+                        "state": statement.excluded.state,
+                        "last_seen_at": statement.excluded.last_seen_at,
+                    },
+                    # 他のワーカーが書き込んだより新しい状態を古い状態で上書きしない
+                    where=or_(Device.last_seen_at.is_(None), statement.excluded.last_seen_at >= Device.last_seen_at),
+                )
+                db.execute(statement)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 書き込めなかった分は次回に再試行する
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        finally:
+            db.close()
+        return len(rows)
+
+heartbeat_table = HeartbeatTable()
+# 他のワーカーが受けてDBへ書き込んだハートビートを取り込む
+def refresh_heartbeats(user_id: int):
+    db = SessionLocal()
+    try:
+        heartbeat_table.load(db, user_id=user_id)
+    finally:
+        db.close()
+
+heartbeat_flusher = PeriodicWorker("heartbeat-flush", HEARTBEAT_FLUSH_INTERVAL, heartbeat_table.flush)
+
+# =======================
+# 再生ログ
+# =======================
+
+# 再生イベントをDBへ書き込む間隔（秒）
+PLAYBACK_FLUSH_INTERVAL = float(os.getenv("PLAYBACK_FLUSH_INTERVAL", "30"))
+# メモリに溜めておける未書き込みイベント数（超えたら503で再送してもらう）
+PLAYBACK_MAX_BUFFERED_EVENTS = int(os.getenv("PLAYBACK_MAX_BUFFERED_EVENTS", "100000"))
+# 1回のリクエストで受け付けるイベント数
+PLAYBACK_MAX_BATCH_SIZE = 1000
+PLAYBACK_FLUSH_BATCH_SIZE = 100
+
+class PlaybackIngestor:
+    """再生イベントをメモリに溜め、定期的に一括で書き込む
+
+    受信時に時間別・アセット別の集計の差分もメモリ上で積み上げておき、
+    書き込み時に生ログの一括INSERTと集計テーブルへの加算UPSERTを1トランザクションで行う。
+    レポートは集計テーブルだけを読むので、生ログを走査しない。
+    """
+
+    def __init__(self):
+        self._events: list = []
+        self._hourly: dict = {}
+        self._assets: dict = {}
+        self._lock = threading.Lock()
+
+    def buffered(self) -> int:
+        return len(self._events)
+
+    def append(self, user_id: int, batch: PlaybackEventBatch) -> bool:
+        with self._lock:
+            if len(self._events) + len(batch.events) > PLAYBACK_MAX_BUFFERED_EVENTS:
+                return False
+            for event in batch.events:
+                started_at = to_local_naive(event.started_at)
+                duration_ms = max(event.duration_ms, 0)
+                self._events.append({
+                    "user_id": user_id,
+                    "device_key": batch.device_key,
+                    "model_id": event.model_id,
+                    "animation_id": event.animation_id,
+                    "anim_name": event.anim_name,
+                    "started_at": started_at,
+                    "duration_ms": duration_ms,
+                })
+                hour_start = started_at.replace(minute=0, second=0, microsecond=0)
+                hourly = self._hourly.setdefault(
+                    (user_id, hour_start, batch.device_key, event.model_id, event.anim_name), [0, 0]
+                )
+                hourly[0] += 1
+                hourly[1] += duration_ms
+                asset = self._assets.setdefault((user_id, event.model_id, event.anim_name), [0, 0, started_at])
+                asset[0] += 1
+                asset[1] += duration_ms
+                asset[2] = max(asset[2], started_at)
+        return True
+
+    def flush(self) -> int:
+        with self._lock:
+            events, hourly, assets = self._events, self._hourly, self._assets
+            self._events, self._hourly, self._assets = [], {}, {}
+        if not events:
+            return 0
+        hourly_rows = [
+            {"user_id": key[0], "hour_start": key[1], "device_key": key[2], "model_id": key[3],
+             "anim_name": key[4], "plays": plays, "total_duration_ms": duration_ms}
+            for key, (plays, duration_ms) in hourly.items()
+        ]
+        asset_rows = [
+            {"user_id": key[0], "model_id": key[1], "anim_name": key[2], "plays": plays,
+             "total_duration_ms": duration_ms, "last_played_at": last_played_at}
+            for key, (plays, duration_ms, last_played_at) in assets.items()
+        ]
+        db = SessionLocal()
+        try:
+            db.execute(insert(PlaybackEvent), events)
+            for offset in range(0, len(hourly_rows), PLAYBACK_FLUSH_BATCH_SIZE):
+                statement = sqlite_insert(PlaybackHourlyRollup).values(
+                    hourly_rows[offset:offset + PLAYBACK_FLUSH_BATCH_SIZE]
+                )
+                db.execute(statement.on_conflict_do_update(
+                    index_elements=[
+                        PlaybackHourlyRollup.user_id, PlaybackHourlyRollup.hour_start,
+                        PlaybackHourlyRollup.device_key, PlaybackHourlyRollup.model_id,
+                        PlaybackHourlyRollup.anim_name,
+                    ],
+                    set_={
+                        "plays": PlaybackHourlyRollup.plays + statement.excluded.plays,
+                        "total_duration_ms": PlaybackHourlyRollup.total_duration_ms + statement.excluded.total_duration_ms,
+                    },
+                ))
+            for offset in range(0, len(asset_rows), PLAYBACK_FLUSH_BATCH_SIZE):
+                statement = sqlite_insert(PlaybackAssetRollup).values(
+                    asset_rows[offset:offset + PLAYBACK_FLUSH_BATCH_SIZE]
+                )
+                db.execute(statement.on_conflict_do_update(
+                    index_elements=[
+                        PlaybackAssetRollup.user_id, PlaybackAssetRollup.model_id, PlaybackAssetRollup.anim_name,
+                    ],
+                    set_={
+                        "plays": PlaybackAssetRollup.plays + statement.excluded.plays,
+                        "total_duration_ms": PlaybackAssetRollup.total_duration_ms + statement.excluded.total_duration_ms,
+                        "last_played_at": func.max(PlaybackAssetRollup.last_played_at, statement.excluded.last_played_at),
+                    },
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 書き込めなかったイベントは戻して次回に再試行する
+            with self._lock:
+                self._events[:0] = events
+                for key, (plays, duration_ms) in hourly.items():
+                    current = self._hourly.setdefault(key, [0, 0])
+                    current[0] += plays
+                    current[1] += duration_ms
+                for key, (plays, duration_ms, last_played_at) in assets.items():
+                    current = self._assets.setdefault(key, [0, 0, last_played_at])
+                    current[0] += plays
+                    current[1] += duration_ms
+                    current[2] = max(current[2], last_played_at)
+            raise
+        finally:
+            db.close()
+        return len(events)
+
+playback_ingestor = PlaybackIngestor()
+playback_flusher = PeriodicWorker("playback-flush", PLAYBACK_FLUSH_INTERVAL, playback_ingestor.flush)
+
+# 集計テーブルから再生レポートを作成
+def get_playback_report(db: Session, user_id: int, group_by: str, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None, device_key: Optional[str] = None) -> List[dict]:
+    if group_by == "asset" and since is None and until is None and device_key is None:
+        rows = db.query(PlaybackAssetRollup).filter(PlaybackAssetRollup.user_id == user_id).order_by(
+            PlaybackAssetRollup.plays.desc()
+        )
+        return [
+            {"model_id": row.model_id, "anim_name": row.anim_name, "plays": row.plays,
+             "total_duration_ms": row.total_duration_ms, "last_played_at": row.last_played_at}
+            for row in rows
+        ]
+    # 期間や端末で絞り込む場合は時間別集計を集約する
+    if group_by == "hour":
+        keys = [PlaybackHourlyRollup.hour_start]
+    elif group_by == "device":
+        keys = [PlaybackHourlyRollup.device_key]
+    else:
+        keys = [PlaybackHourlyRollup.model_id, PlaybackHourlyRollup.anim_name]
+    query = db.query(
+        *keys,
+        func.sum(PlaybackHourlyRollup.plays).label("plays"),
+        func.sum(PlaybackHourlyRollup.total_duration_ms).label("total_duration_ms"),
+    ).filter(PlaybackHourlyRollup.user_id == user_id)
+    if since is not None:
+        query = query.filter(PlaybackHourlyRollup.hour_start >= since.replace(minute=0, second=0, microsecond=0))
+    if until is not None:
+        query = query.filter(PlaybackHourlyRollup.hour_start < until)
+    if device_key is not None:
+        query = query.filter(PlaybackHourlyRollup.device_key == device_key)
+    return [dict(row._mapping) for row in query.group_by(*keys).order_by(*keys)]
+
+# =======================
+# 階層化ストレージ
+# =======================
+
+# 長く表示されていないアップロードファイルを移すコールド層（別のマウントを指定してもよい）
+COLD_STORAGE_ROOT = os.getenv("COLD_STORAGE_DIR", "cold_storage")
+# 最後のアクセスからこの日数が過ぎたファイルをコールド層へ移す（0で無効）
+TIERING_COLD_AFTER_DAYS = float(os.getenv("TIERING_COLD_AFTER_DAYS", "90"))
+# アップロード先の空き容量がこれを下回ったら、アクセスの古い順に追加で移す（バイト、0で無効）
+TIERING_MIN_FREE_BYTES = int(os.getenv("TIERING_MIN_FREE_BYTES", str(1024 * 1024 * 1024)))
+# 空き容量が足りなくても、この時間内にアクセスされたファイルは移さない（秒）
+TIERING_HOT_PROTECT_SECONDS = int(os.getenv("TIERING_HOT_PROTECT_SECONDS", str(24 * 3600)))
+# コールド層へ移すファイルを探す間隔（秒）と、アクセス日時をDBへ書き込む間隔（秒）
+TIERING_INTERVAL = float(os.getenv("TIERING_INTERVAL", "3600"))
+ASSET_ACCESS_FLUSH_INTERVAL = float(os.getenv("ASSET_ACCESS_FLUSH_INTERVAL", "60"))
+# gzip の圧縮レベルと、圧縮したまま保存する条件（圧縮後の大きさが元の何倍以下か）
+TIERING_COMPRESS_LEVEL = int(os.getenv("TIERING_COMPRESS_LEVEL", "6"))
+TIERING_MAX_COMPRESSED_RATIO = float(os.getenv("TIERING_MAX_COMPRESSED_RATIO", "0.95"))
+# 圧縮済みの形式は gzip をかけずにそのまま移す
+TIERING_PRECOMPRESSED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+class TieredStorage:
+    """uploads/ をホット層とし、長く使われていないファイルをコールド層へ移す
+
+    コールド層には uploads/ と同じ相対パスで、gzip で圧縮したもの（.gz）か元のままのファイルを置く。
+    URLは変わらず、ホット層にないファイルへのリクエストが来たらコールド層から展開しながら返し、
+    同時にホット層へ書き戻す。アクセス日時はメモリに集めて定期的にDBへ書き込む。
+    """
+
+    def __init__(self, hot_root: str = UPLOAD_ROOT, cold_root: str = COLD_STORAGE_ROOT):
+        self.hot_root = hot_root
+        self.cold_root = cold_root
+        self._accessed: dict = {}
+        self._lock = threading.Lock()
+        self._incompressible: set = set()
+        # 書き戻し中のファイル（相対パス -> 完了を知らせる anyio.Event）。イベントループからだけ操作する
+        self.promotions: dict = {}
+        self.report: dict = {"last_run_at": None, "demoted": 0, "freed_bytes": 0, "promoted": 0}
+
+    def relative(self, file_path: str) -> str:
+        """ホット層のファイルパスを相対パス（/ 区切り）に変換"""
+        return os.path.relpath(file_path, self.hot_root).replace(os.sep, "/")
+
+    def hot_path(self, relative: str) -> str:
+        return os.path.join(self.hot_root, *relative.split("/"))
+
+    def cold_file(self, relative: str) -> Optional[tuple]:
+        """コールド層にあれば (ファイルパス, 圧縮されているか) を返す"""
+        base = os.path.join(self.cold_root, *relative.split("/"))
+        for cold_path, compressed in ((base + ".gz", True), (base, False)):
+            if os.path.isfile(cold_path):
+                return cold_path, compressed
+        return None
+
+    def exists(self, file_path: str) -> bool:
+        """ホット層・コールド層のどちらかにあるか"""
+        return os.path.exists(file_path) or self.cold_file(self.relative(file_path)) is not None
+
+    def remove_cold(self, relative: str):
+        while True:
+            cold = self.cold_file(relative)
+            if cold is None:
+                return
+            os.remove(cold[0])
+
+    @staticmethod
+    def original_size(cold_path: str, compressed: bool) -> int:
+        if not compressed:
+            return os.path.getsize(cold_path)
+        # gzip の末尾4バイトが元の大きさ（4GiB未満のファイルのみを扱う）
+        with open(cold_path, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", f.read(4))[0]
+
+    def open(self, file_path: str) -> tuple:
+        """ホット層・コールド層のどちらにあっても読めるように開き、(ファイル, 大きさ, 更新時刻) を返す"""
+        try:
+            source = open(file_path, "rb")
+            stat_result = os.fstat(source.fileno())
+            return source, stat_result.st_size, stat_result.st_mtime
+        except FileNotFoundError:
+            cold = self.cold_file(self.relative(file_path))
+            if cold is None:
+                raise
+        cold_path, compressed = cold
+        size = self.original_size(cold_path, compressed)
+        source = gzip.open(cold_path, "rb") if compressed else open(cold_path, "rb")
+        return source, size, os.path.getmtime(cold_path)
+
+    # =========== アクセスの記録 ===========
+
+    def record_access(self, relative: str):
+        with self._lock:
+            self._accessed[relative] = datetime.utcnow()
+
+    def flush_access(self) -> int:
+        """記録したアクセス日時をまとめてDBへ書き込む"""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        if not accessed:
+            return 0
+        rows = [{"path": path, "last_accessed_at": at} for path, at in accessed.items()]
+        db = SessionLocal()
+        try:
+            for offset in range(0, len(rows), HEARTBEAT_FLUSH_BATCH_SIZE):
+                statement = sqlite_insert(AssetAccess).values(rows[offset:offset + HEARTBEAT_FLUSH_BATCH_SIZE])
+                db.execute(statement.on_conflict_do_update(
+                    index_elements=[AssetAccess.path],
+                    set_={"last_accessed_at": func.max(statement.excluded.last_accessed_at, AssetAccess.last_accessed_at)},
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 書き込めなかった分は次回に再試行する
+            with self._lock:
+                for path, at in accessed.items():
+                    self._accessed[path] = max(at, self._accessed.get(path, at))
+            raise
+        finally:
+            db.close()
+        return len(rows)
+
+    # =========== コールド層への移動 ===========
+
+    def demote(self, relative: str) -> Optional[int]:
+        """ファイルをコールド層へ移し、ホット層のファイルシステムで空いたバイト数を返す
+
+        コールド層が同じファイルシステムにある場合、圧縮で縮まないファイルは移しても
+        空き容量が増えないので移さずに None を返す。
+        """
+        hot_path = self.hot_path(relative)
+        stat_result = os.stat(hot_path)
+        signature = (relative, stat_result.st_mtime_ns, stat_result.st_size)
+        if signature in self._incompressible:
+            return None
+        base = os.path.join(self.cold_root, *relative.split("/"))
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        same_device = os.stat(self.cold_root).st_dev == stat_result.st_dev
+        compressed = os.path.splitext(relative)[1].lower() not in TIERING_PRECOMPRESSED_EXTENSIONS
+        if compressed:
+            part_path = base + ".gz.part"
+            with open(hot_path, "rb") as source, open(part_path, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=TIERING_COMPRESS_LEVEL, mtime=0) as destination:
+                    shutil.copyfileobj(source, destination, LARGE_ASSET_CHUNK_SIZE)
+                raw.flush()
+                os.fsync(raw.fileno())
+            if os.path.getsize(part_path) > stat_result.st_size * TIERING_MAX_COMPRESSED_RATIO:
+                # ほとんど縮まないなら展開の手間を省くためにそのまま置く
+                os.remove(part_path)
+                compressed = False
+        if not compressed:
+            if same_device:
+                # 同じファイルシステムにそのまま置いても空き容量は増えない（次回からは圧縮も試さない）
+                self._incompressible.add(signature)
+                return None
+            part_path = base + ".part"
+            with open(hot_path, "rb") as source, open(part_path, "wb") as destination:
+                shutil.copyfileobj(source, destination, LARGE_ASSET_CHUNK_SIZE)
+                destination.flush()
+                os.fsync(destination.fileno())
+        cold_size = os.path.getsize(part_path)
+        os.utime(part_path, (stat_result.st_atime, stat_result.st_mtime))
+        os.replace(part_path, base + ".gz" if compressed else base)
+        os.remove(hot_path)
+        return stat_result.st_size - cold_size if same_device else stat_result.st_size
+
+    def _load_candidates(self) -> List[tuple]:
+        """参照されていてホット層にあるファイルを (最終アクセス日時, 相対パス) の古い順で返す"""
+        db = SessionLocal()
+        try:
+            url_paths = {row[0] for row in db.query(VRMModel.vrm_path)}
+            url_paths |= {row[0] for row in db.query(VRMAnimation.vrma_path)}
+            url_paths |= {row[0] for row in db.query(Background.path)}
+            url_paths |= {row[0] for row in db.query(Background.optimized_path).filter(
+                Background.optimized_path.isnot(None))}
+            accessed = dict(db.query(AssetAccess.path, AssetAccess.last_accessed_at))
+        finally:
+            db.close()
+        candidates = []
+        for url_path in url_paths:
+            if not url_path.startswith(f"/{self.hot_root}/"):
+                continue
+            relative = self.relative(url_path_to_file_path(url_path))
+            try:
+                modified = datetime.utcfromtimestamp(os.path.getmtime(self.hot_path(relative)))
+            except FileNotFoundError:
+                continue
+            # 一度も配信されていないファイルはアップロード（書き戻し）した時刻を最終アクセスとみなす
+            last_accessed_at = max(accessed.get(relative) or modified, modified)
+            candidates.append((last_accessed_at, relative))
+        return sorted(candidates)
+
+    def run(self) -> dict:
+        """古いファイルと、空き容量が足りない分をコールド層へ移す"""
+        self.flush_access()
+        now = datetime.utcnow()
+        cold_before = now - timedelta(days=TIERING_COLD_AFTER_DAYS) if TIERING_COLD_AFTER_DAYS > 0 else None
+        protected_after = now - timedelta(seconds=TIERING_HOT_PROTECT_SECONDS)
+        demoted = freed = 0
+        for last_accessed_at, relative in self._load_candidates():
+            expired = cold_before is not None and last_accessed_at < cold_before
+            if not expired and (
+                TIERING_MIN_FREE_BYTES <= 0
+                or last_accessed_at >= protected_after
+                or shutil.disk_usage(self.hot_root).free >= TIERING_MIN_FREE_BYTES
+            ):
+                # 古い順に見ているので、これ以降に移すファイルはない
+                break
+            try:
+                freed_bytes = self.demote(relative)
+            except OSError as e:
+                print(f"コールド層への移動に失敗しました: {relative} ({e})")
+                continue
+            if freed_bytes is not None:
+                freed += freed_bytes
+                demoted += 1
+        self.report.update({"last_run_at": now.isoformat(), "demoted": demoted, "freed_bytes": freed})
+        return self.report
+
+    # =========== ホット層への書き戻し ===========
+
+    def promotion_response(self, path: str, method: str) -> Optional["PromotingResponse"]:
+        """コールド層にあるファイルなら、展開しながら返すレスポンスを作る"""
+        relative = path.replace(os.sep, "/")
+        if os.path.isabs(path) or relative == ".." or relative.startswith("../"):
+            return None
+        cold = self.cold_file(relative)
+        if cold is None:
+            return None
+        cold_path, compressed = cold
+        return PromotingResponse(self, relative, cold_path, compressed, method)
+
+    def promoted(self, relative: str):
+        with self._lock:
+            self.report["promoted"] += 1
+        self.record_access(relative)
+
+tiered_storage = TieredStorage()
+
+class ColdPromotion:
+    """コールド層のファイルを少しずつ展開し、読んだ分をホット層の一時ファイルへ書き込む"""
+
+    def __init__(self, storage: TieredStorage, relative: str, cold_path: str, compressed: bool):
+        self.storage = storage
+        self.relative = relative
+        self.cold_path = cold_path
+        self.hot_path = storage.hot_path(relative)
+        self.part_path = f"{self.hot_path}.{uuid.uuid4().hex}.part"
+        os.makedirs(os.path.dirname(self.hot_path), exist_ok=True)
+        self._source = gzip.open(cold_path, "rb") if compressed else open(cold_path, "rb")
+        self._destination = open(self.part_path, "wb")
+
+    def step(self) -> bytes:
+        chunk = self._source.read(LARGE_ASSET_CHUNK_SIZE)
+        if chunk:
+            self._destination.write(chunk)
+        return chunk
+
+    def commit(self):
+        self._source.close()
+        self._destination.flush()
+        os.fsync(self._destination.fileno())
+        self._destination.close()
+        os.replace(self.part_path, self.hot_path)
+        try:
+            os.remove(self.cold_path)
+        except FileNotFoundError:
+            # 他のワーカーが同じファイルを先に書き戻した
+            pass
+        self.storage.promoted(self.relative)
+
+    def abort(self):
+        self._source.close()
+        self._destination.close()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+class PromotingResponse(Response):
+    """コールド層のファイルを展開しながら返し、同時にホット層へ書き戻すレスポンス
+
+    同じファイルへの同時リクエストは1つだけが書き戻し、残りは書き戻し後のファイルを返す。
+    待っているリクエストはスレッドを使わないので、書き戻し側の読み書きが詰まることはない。
+    """
+
+    def __init__(self, storage: TieredStorage, relative: str, cold_path: str, compressed: bool, method: str):
+        self.storage = storage
+        self.relative = relative
+        self.cold_path = cold_path
+        self.compressed = compressed
+        self.status_code = status.HTTP_200_OK
+        self.media_type = mimetypes.guess_type(relative)[0] or "application/octet-stream"
+        self.background = None
+        self.send_header_only = method.upper() == "HEAD"
+        self.init_headers({"content-length": str(storage.original_size(cold_path, compressed))})
+
+    async def __call__(self, scope, receive, send):
+        if self.send_header_only:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        hot_path = self.storage.hot_path(self.relative)
+        while True:
+            # 他のリクエストが書き戻し中なら、スレッドを使わずにイベントループ上で完了を待つ
+            pending = self.storage.promotions.get(self.relative)
+            if pending is not None:
+                await pending.wait()
+                continue
+            if await anyio.to_thread.run_sync(os.path.exists, hot_path):
+                await self._send_hot_file(hot_path, scope, receive, send)
+                return
+            cold = await anyio.to_thread.run_sync(self.storage.cold_file, self.relative)
+            if cold is None:
+                await PlainTextResponse("Not Found", status_code=status.HTTP_404_NOT_FOUND)(scope, receive, send)
+                return
+            if self.relative in self.storage.promotions:
+                # 確認している間に他のリクエストが書き戻しを始めた
+                continue
+            finished = self.storage.promotions[self.relative] = anyio.Event()
+            try:
+                try:
+                    promotion = await anyio.to_thread.run_sync(ColdPromotion, self.storage, self.relative, *cold)
+                except FileNotFoundError:
+                    # 他のワーカーが書き戻してコールド層から消えた
+                    continue
+                await self._stream_promotion(promotion, send)
+                return
+            finally:
+                del self.storage.promotions[self.relative]
+                finished.set()
+
+    async def _send_hot_file(self, hot_path: str, scope, receive, send):
+        headers = {
+            key: value for key, value in self.headers.items() if key not in ("content-length", "content-type")
+        }
+        await FileResponse(hot_path, media_type=self.media_type, headers=headers)(scope, receive, send)
+
+    async def _stream_promotion(self, promotion: ColdPromotion, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            while True:
+                chunk = await anyio.to_thread.run_sync(promotion.step)
+                if not chunk:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await anyio.to_thread.run_sync(promotion.commit)
+        except BaseException:
+            await anyio.to_thread.run_sync(promotion.abort)
+            raise
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+asset_access_flusher = PeriodicWorker("asset-access-flush", ASSET_ACCESS_FLUSH_INTERVAL, tiered_storage.flush_access)
+tiering_worker = PeriodicWorker("tiering", TIERING_INTERVAL, tiered_storage.run, run_on_stop=False)
+
+# =======================
+# 背景画像の最適化
+# =======================
+
+# GIF背景を変換するアニメーションWebPのフレームレート上限・長辺の上限（ピクセル）・画質
+BACKGROUND_WEBP_MAX_FPS = float(os.getenv("BACKGROUND_WEBP_MAX_FPS", "15"))
+BACKGROUND_WEBP_MAX_DIMENSION = int(os.getenv("BACKGROUND_WEBP_MAX_DIMENSION", "1024"))
+BACKGROUND_WEBP_QUALITY = int(os.getenv("BACKGROUND_WEBP_QUALITY", "80"))
+# 変換中にメモリに保持するフレームの合計ピクセル数の上限（RGBAで1ピクセル4バイト）
+# 超えるGIFは変換せずに元のGIFを使う
+BACKGROUND_WEBP_MAX_PIXELS = int(os.getenv("BACKGROUND_WEBP_MAX_PIXELS", str(32 * 1024 * 1024)))
+
+# 変換はCPUを使うので別プロセスで行う（最初の変換時に起動）
+media_executor: Optional[ProcessPoolExecutor] = None
+background_optimize_tasks: set = set()
+
+class TranscodeBudgetExceeded(Exception):
+    """変換に必要なメモリが上限を超えるGIF"""
+
+# 変換用のプロセスは fork せずに起動する（スレッドを持つサーバープロセスからの fork を避ける）
+def media_process_context():
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+# アニメーションWebPを書き出せるか確認（PillowがWebP対応でビルドされている必要がある）
+def webp_animation_supported() -> bool:
+    try:
+        from PIL import features
+        return bool(features.check("webp") and features.check("webp_anim"))
+    except ImportError:
+        return False
+
+def transcode_gif_to_webp(source: str, destination: str, max_fps: float, max_dimension: int, quality: int,
+                          max_pixels: int = BACKGROUND_WEBP_MAX_PIXELS) -> dict:
+    """GIFをアニメーションWebPに変換する（ワーカープロセスで実行）
+
+    フレームレートが上限を超える場合はフレームを間引き、間引いたフレームの表示時間は直前のフレームに足す。
+    残したフレームは保存まですべてメモリに保持するので、合計ピクセル数が max_pixels を超えたら
+    TranscodeBudgetExceeded で中止する。
+    """
+    from PIL import Image, ImageSequence
+
+    min_frame_ms = 1000 / max_fps if max_fps > 0 else 0
+    frames = []
+    durations = []
+    pixels = 0
+    with Image.open(source) as image:
+        loop = image.info.get("loop", 0)
+        for frame in ImageSequence.Iterator(image):
+            duration = frame.info.get("duration", 100) or 100
+            if frames and durations[-1] < min_frame_ms:
+                durations[-1] += duration
+                continue
+            frame = frame.convert("RGBA")
+            if max_dimension and max(frame.size) > max_dimension:
+                frame.thumbnail((max_dimension, max_dimension))
+            pixels += frame.width * frame.height
+            if max_pixels and pixels > max_pixels:
+                raise TranscodeBudgetExceeded(f"フレームの合計が{max_pixels}ピクセルを超えます")
+            frames.append(frame)
+            durations.append(duration)
+    durations = [int(round(duration)) for duration in durations]
+    frames[0].save(
+        destination,
+        format="WEBP",
+        save_all=len(frames) > 1,
+        append_images=frames[1:],
+        duration=durations,
+        loop=loop,
+        quality=quality,
+        method=4,
+    )
+    return {
+        "frame_count": len(frames),
+        "duration_ms": sum(durations),
+        "width": frames[0].width,
+        "height": frames[0].height,
+    }
+
+# 変換結果をデータベースに反映する
+def save_background_optimization(background_id: int, optimized_path: str, metadata: dict) -> bool:
+    db = SessionLocal()
+    try:
+        db_background = get_background(db, background_id)
+        if db_background is None:
+            return False
+        db_background.optimized_path = optimized_path
+        db_background.frame_count = metadata["frame_count"]
+        db_background.duration_ms = metadata["duration_ms"]
+        db_background.width = metadata["width"]
+        db_background.height = metadata["height"]
+        commit_library_change(db, db_background.user_id, [("background", background_id, "upsert")])
+        # スケジュールの解決結果にも変換後のパスを含める
+        schedule_cache.invalidate(db_background.user_id)
+        return True
+    finally:
+        db.close()
+
+async def optimize_background(background_id: int, file_path: str):
+    global media_executor
+    if media_executor is None:
+        media_executor = ProcessPoolExecutor(max_workers=1, mp_context=media_process_context())
+    destination = os.path.splitext(file_path)[0] + ".webp"
+    try:
+        metadata = await asyncio.get_running_loop().run_in_executor(
+            media_executor, transcode_gif_to_webp, file_path, destination,
+            BACKGROUND_WEBP_MAX_FPS, BACKGROUND_WEBP_MAX_DIMENSION, BACKGROUND_WEBP_QUALITY,
+            BACKGROUND_WEBP_MAX_PIXELS,
+        )
+        url_path = "/" + destination.replace("\\", "/")
+        saved = await anyio.to_thread.run_sync(save_background_optimization, background_id, url_path, metadata)
+        if not saved and os.path.exists(destination):
+            # 変換中に背景画像が削除された
+            os.remove(destination)
+    except TranscodeBudgetExceeded as e:
+        # 変換せずに元のGIFをそのまま配信する
+        print(f"Background optimize skipped ({background_id}): {e}")
+    except Exception as e:
+        print(f"Background optimize error: {str(e)}\n{traceback.format_exc()}")
+        if os.path.exists(destination):
+            os.remove(destination)
+
+# GIF背景の変換を予約する（アップロードのレスポンスは変換を待たない）
+def schedule_background_optimization(background_id: int, file_path: str):
+    if not webp_animation_supported():
+        return
+    task = asyncio.get_running_loop().create_task(optimize_background(background_id, file_path))
+    background_optimize_tasks.add(task)
+    task.add_done_callback(background_optimize_tasks.discard)
+
+# =======================
+# ライブラリのエクスポート・インポート
+# =======================
+
+# アーカイブの形式バージョンと、ファイルを読み書きするときのチャンクサイズ
+LIBRARY_ARCHIVE_FORMAT = 1
+LIBRARY_ARCHIVE_CHUNK_SIZE = 1024 * 1024
+# インポートで受け付けるファイルの配置先（uploads/<user_id>/ からの相対ディレクトリ）と拡張子
+LIBRARY_IMPORT_EXTENSIONS = {
+    "": {".vrm", ".glb"},
+    "animations": {".vrma", ".glb"},
+    "backgrounds": {".jpg", ".jpeg", ".png", ".gif", ".webp"},
+}
+# 取り込み時にGLBとして検証するディレクトリと必要な拡張
+LIBRARY_IMPORT_VALIDATION = {
+    "": VRM_MODEL_EXTENSIONS,
+    "animations": VRM_ANIMATION_EXTENSIONS,
+}
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# アーカイブ内のファイル名（files/ + uploads/<user_id>/ からの相対パス）
+def archive_member_name(url_path: str, user_id: int) -> str:
+    prefix = f"/{UPLOAD_ROOT}/{user_id}/"
+    relative = url_path[len(prefix):] if url_path.startswith(prefix) else os.path.basename(url_path)
+    return "files/" + relative
+
+def _tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+def _tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % TAR_BLOCK_SIZE)
+
+# ユーザーのライブラリの行をマニフェストとして読み込む
+def build_library_manifest(db: Session, user_id: int) -> dict:
+    def file_entry(url_path):
+        if url_path and tiered_storage.exists(url_path_to_file_path(url_path)):
+            return archive_member_name(url_path, user_id)
+        return None
+
+    models = []
+    for model in list_vrm_model_dicts(db, user_id):
+        models.append({
+            "name": model["name"],
+            "file": file_entry(model["vrm_path"]),
+            "animations": [
+                {"anim_name": animation["anim_name"], "file": file_entry(animation["vrma_path"])}
+                for animation in model["animations"]
+            ],
+        })
+    backgrounds = []
+    for background in list_background_dicts(db, user_id):
+        backgrounds.append({
+            "filename": background["filename"],
+            "file": file_entry(background["path"]),
+            "optimized_file": file_entry(background["optimized_path"]),
+            "frame_count": background["frame_count"],
+            "duration_ms": background["duration_ms"],
+            "width": background["width"],
+            "height": background["height"],
+        })
+    return {
+        "format": LIBRARY_ARCHIVE_FORMAT,
+        "exported_at": datetime.utcnow().isoformat(),
+        "models": models,
+        "backgrounds": backgrounds,
+    }
+
+def iter_library_archive(manifest: dict, user_id: int):
+    """マニフェストとファイルをtar形式で少しずつ生成する（アーカイブ全体を保持しない）"""
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+    yield _tar_header("manifest.json", len(manifest_bytes), time.time())
+    yield manifest_bytes + _tar_padding(len(manifest_bytes))
+
+    members = []
+    for model in manifest["models"]:
+        members.append(model["file"])
+        members.extend(animation["file"] for animation in model["animations"])
+    for background in manifest["backgrounds"]:
+        members.extend([background["file"], background["optimized_file"]])
+
+    prefix = os.path.join(UPLOAD_ROOT, str(user_id))
+    for member in members:
+        if member is None:
+            continue
+        file_path = os.path.join(prefix, member[len("files/"):])
+        try:
+            # コールド層のファイルは書き戻さずに展開しながら読む
+            source, size, mtime = tiered_storage.open(file_path)
+        except FileNotFoundError:
+            continue
+        with source:
+            remaining = size
+            yield _tar_header(member, remaining, mtime)
+            while remaining > 0:
+                chunk = source.read(min(LIBRARY_ARCHIVE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    # 読み込み中にファイルが短くなった場合はヘッダーのサイズに合わせて埋める
+                    chunk = b"\0" * min(LIBRARY_ARCHIVE_CHUNK_SIZE, remaining)
+                remaining -= len(chunk)
+                yield chunk
+            yield _tar_padding(size)
+    # アーカイブの終端
+    yield b"\0" * (TAR_BLOCK_SIZE * 2)
+
+class ArchiveStreamReader(io.RawIOBase):
+    """非同期に受信したリクエストボディを、別スレッドの tarfile から同期的に読めるようにする
+
+    キューの長さで受信側に背圧をかけるので、メモリ使用量はアーカイブの大きさによらない。
+    """
+
+    def __init__(self, max_chunks: int = 16):
+        super().__init__()
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_chunks)
+        self._buffer = b""
+        self._eof = False
+        self.abandoned = threading.Event()
+
+    def readable(self) -> bool:
+        return True
+
+    def feed(self, chunk: Optional[bytes]):
+        """チャンクを渡す（None で終端）。読み手が中断していたら捨てる"""
+        while not self.abandoned.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def try_feed(self, chunk: Optional[bytes]) -> bool:
+        try:
+            self._queue.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+# ライブラリの取り込みは、アップロードの書き込みと同じ低優先度のスレッドで行う
+# （取り込みはリクエストボディの受信を待つ間もスレッドを占有するので、upload_io_executor とは分ける）
+library_import_executor = ThreadPoolExecutor(
+    max_workers=UPLOAD_MAX_CONCURRENT, thread_name_prefix="library-import", initializer=_lower_upload_io_priority
+)
+
+def import_library_archive(reader: ArchiveStreamReader, user_id: int):
+    """tarアーカイブを先頭から読みながらファイルを書き出し、最後に行を1トランザクションで登録する
+
+    取り込んだ件数と、WebPへの変換が必要なGIF背景の (id, ファイルパス) のリストを返す。
+    """
+    written: List[str] = []
+    file_map: dict = {}
+    manifest = None
+    try:
+        with tarfile.open(fileobj=reader, mode="r|") as archive:
+            for member in archive:
+                if member.name == "manifest.json" and member.isfile():
+                    manifest = json.loads(archive.extractfile(member).read().decode("utf-8"))
+                    continue
+                if not member.isfile() or not member.name.startswith("files/"):
+                    continue
+                relative = member.name[len("files/"):]
+                subdir, filename = os.path.split(relative)
+                extension = os.path.splitext(filename)[1].lower()
+                if extension not in LIBRARY_IMPORT_EXTENSIONS.get(subdir, set()):
+                    continue
+                target_dir = os.path.join(UPLOAD_ROOT, str(user_id), subdir)
+                os.makedirs(target_dir, exist_ok=True)
+                file_path = os.path.join(target_dir, f"{uuid.uuid4()}{extension}")
+                required_extensions = LIBRARY_IMPORT_VALIDATION.get(subdir)
+                validator = GLBStreamValidator(required_extensions) if required_extensions else None
+                try:
+                    # アップロードと同じく .part に書いてから名前を変え、ページキャッシュを押し出さない
+                    _copy_upload_file(archive.extractfile(member), file_path, validator)
+                except InvalidAssetError as e:
+                    # 読み込めないファイルは取り込まない（マニフェスト側でスキップ扱いになる）
+                    print(f"ライブラリの取り込みでファイルをスキップしました: {member.name} ({e})")
+                    continue
+                written.append(file_path)
+                file_map[member.name] = "/" + file_path.replace("\\", "/")
+        # 末尾の余分なデータを読み捨てて、受信側が詰まらないようにする
+        while reader.read(LIBRARY_ARCHIVE_CHUNK_SIZE):
+            pass
+        if manifest is None or manifest.get("format") != LIBRARY_ARCHIVE_FORMAT:
+            raise ValueError("manifest.json が見つからないか、対応していない形式です")
+
+        imported = {"models": 0, "animations": 0, "backgrounds": 0, "skipped": 0}
+        created: List[tuple] = []
+        to_optimize: List[tuple] = []
+        db = SessionLocal()
+        try:
+            for model in manifest.get("models", []):
+                vrm_path = file_map.get(model.get("file"))
+                if vrm_path is None:
+                    imported["skipped"] += 1 + len(model.get("animations", []))
+                    continue
+                db_vrm = VRMModel(name=model["name"], vrm_path=vrm_path, user_id=user_id)
+                db.add(db_vrm)
+                db.flush()
+                created.append(("model", db_vrm))
+                imported["models"] += 1
+                animations = []
+                for animation in model.get("animations", []):
+                    vrma_path = file_map.get(animation.get("file"))
+                    if vrma_path is None:
+                        imported["skipped"] += 1
+                        continue
+                    animations.append(VRMAnimation(
+                        anim_name=animation["anim_name"], vrma_path=vrma_path, model_id=db_vrm.id, user_id=user_id
+                    ))
+                db.add_all(animations)
+                created.extend(("animation", animation) for animation in animations)
+                imported["animations"] += len(animations)
+            backgrounds = []
+            for background in manifest.get("backgrounds", []):
+                path = file_map.get(background.get("file"))
+                if path is None:
+                    imported["skipped"] += 1
+                    continue
+                optimized_path = file_map.get(background.get("optimized_file"))
+                backgrounds.append(Background(
+                    filename=background["filename"],
+                    path=path,
+                    user_id=user_id,
+                    optimized_path=optimized_path,
+                    frame_count=background.get("frame_count") if optimized_path else None,
+                    duration_ms=background.get("duration_ms") if optimized_path else None,
+                    width=background.get("width") if optimized_path else None,
+                    height=background.get("height") if optimized_path else None,
+                ))
+            db.add_all(backgrounds)
+            created.extend(("background", background) for background in backgrounds)
+            imported["backgrounds"] = len(backgrounds)
+            db.flush()
+            # 変換後のWebPが含まれていないGIF背景は、アップロード時と同じく変換する
+            to_optimize = [
+                (background.id, url_path_to_file_path(background.path))
+                for background in backgrounds
+                if background.optimized_path is None and background.path.lower().endswith(".gif")
+            ]
+            if created:
+                commit_library_change(db, user_id, [(kind, row.id, "upsert") for kind, row in created])
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return imported, to_optimize
+    except Exception:
+        for file_path in written:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        raise
+    finally:
+        reader.abandoned.set()
+
 # =======================
 # FastAPIアプリケーション
 # =======================
 
 # FastAPIアプリケーションの作成
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# アップロードの流量制御
+app.add_middleware(UploadAdmissionMiddleware, controller=upload_admission)
 
 # 静的ファイルの設定
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", AssetStaticFiles(directory="static", fingerprints=static_fingerprints), name="static")
 
 # アップロードディレクトリも静的ファイルとしてマウント
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# アップロードされたファイルはUUIDのファイル名で作成後に書き換えないので immutable で配信する
+app.mount("/uploads", AssetStaticFiles(directory=UPLOAD_ROOT, immutable=True, tiers=tiered_storage), name="uploads")
 
 # テンプレートディレクトリの設定
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_fingerprints.url_for
+
+# バックグラウンドジョブの開始・停止
+@app.on_event("startup")
+def start_background_jobs():
+    # マルチワーカーではfork前に親プロセスで用意済み
+    if not static_fingerprints.built:
+        preload_static_state()
+    # アップロード先の整合性チェックは1つのワーカーだけで行う
+    if WORKER_INDEX == 0:
+        upload_reconciler.start()
+        tiering_worker.start()
+    db = SessionLocal()
+    try:
+        heartbeat_table.load(db)
+    finally:
+        db.close()
+    heartbeat_flusher.start()
+    playback_flusher.start()
+    asset_access_flusher.start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    upload_reconciler.stop()
+    heartbeat_flusher.stop()
+    playback_flusher.stop()
+    tiering_worker.stop()
+    asset_access_flusher.stop()
+    if media_executor is not None:
+        # 実行待ちの変換は取り消す（shutdown の cancel_futures は Python 3.9 以降なので使わない）
+        for task in list(background_optimize_tasks):
+            task.cancel()
+        media_executor.shutdown(wait=False)
 
 # =======================
 # エンドポイント
@@ -450,8 +3378,8 @@ templates = Jinja2Templates(directory="templates")
 
 # ルートパス
 @app.get("/")
-def read_index(request: Request): 
-    return templates.TemplateResponse("index.html", {"request": request})
+def read_index(request: Request):
+    return cached_page_response(request, "index.html")
 
 # トークン取得エンドポイント（ログイン）
 @app.post("/token", response_model=Token)
@@ -479,14 +3407,51 @@ def create_user_endpoint(user: UserCreate, db: Session = Depends(get_db)):
 
 # 現在のユーザー情報取得エンドポイント
 @app.get("/users/me/", response_model=UserSchema)
-async def read_users_me(current_user: UserSchema = Depends(get_current_active_user)):
-    return current_user
+def read_users_me(current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    # response_model はドキュメント用。検証を省いて辞書をそのまま返す
+    return FastJSONResponse(user_to_dict(db, current_user))
+
+# ライブラリの一覧レスポンス（バージョンが変わっていなければ一覧を作らずに304を返す）
+def library_list_response(request: Request, db: Session, user_id: int, build_list):
+    etag = library_etag(user_id, library_versions.get(db, user_id))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FastJSONResponse(build_list(), headers=headers)
 
 # モデル一覧取得エンドポイント
 @app.get("/models/", response_model=List[VRMModelBase])
-def get_models(current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    models = get_vrm_models(db, user_id=current_user.id)
-    return models
+def get_models(request: Request, current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return library_list_response(
+        request, db, current_user.id, lambda: list_vrm_model_dicts(db, user_id=current_user.id)
+    )
+
+# モデル削除エンドポイント（アニメーションも含む）
+@app.delete("/models/{model_id}")
+def delete_model_endpoint(
+    model_id: int,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    file_paths = delete_vrm_model(db, model_id, current_user.id)
+    if file_paths is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
+    # ファイルの削除はバックグラウンドで行う
+    file_removal_queue.enqueue(file_paths)
+    return {"status": "success", "removed_files": len(file_paths)}
+
+# アニメーション削除エンドポイント
+@app.delete("/animations/{animation_id}")
+def delete_animation_endpoint(
+    animation_id: int,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    file_paths = delete_vrm_animation(db, animation_id, current_user.id)
+    if file_paths is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Animation not found")
+    file_removal_queue.enqueue(file_paths)
+    return {"status": "success", "removed_files": len(file_paths)}
 
 # モデルとアニメーションのアップロードエンドポイント
 @app.post("/upload/")
@@ -498,28 +3463,9 @@ async def upload_model(
     db: Session = Depends(get_db)
 ):
     try:
-        # ユーザーごとのディレクトリを作成
-        user_dir = os.path.join("uploads", str(current_user.id))
-        anim_dir = os.path.join(user_dir, "animations")
-        os.makedirs(user_dir, exist_ok=True)
-        os.makedirs(anim_dir, exist_ok=True)
+        # VRMモデルとアニメーションを保存（不正なファイルが1つでもあれば何も登録しない）
+        model, animations = await create_vrm_model(db, name, vrm_file, current_user.id, vrma_files)
 
-        # VRMモデルを保存
-        model = await create_vrm_model(db, name, vrm_file, current_user.id)
-        
-        # アニメーションファイルがある場合、それぞれ保存
-        animations = []
-        if vrma_files:
-            for vrma_file in vrma_files:
-                if vrma_file.filename:
-                    # ファイル名からアニメーション名を抽出（拡張子を除く）
-                    anim_name = Path(vrma_file.filename).stem
-                    animation = await create_vrm_animation(
-                        db, anim_name, vrma_file, model.id, current_user.id
-                    )
-                    if animation:
-                        animations.append(animation)
-        
         # モデルとアニメーション情報を返す
         return {
             "model": {
@@ -535,6 +3481,8 @@ async def upload_model(
             } for anim in animations
             ]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         # 詳細なエラー情報を記録
         error_details = traceback.format_exc()
@@ -569,9 +3517,7 @@ async def upload_background(
         file_path = os.path.join(user_dir, unique_filename)
         
         # ファイルを保存
-        with open(file_path, "wb") as buffer:
-            content = await background_file.read()
-            buffer.write(content)
+        await save_upload_file(background_file, file_path)
             
         # データベースに背景画像情報を保存
         # URLパスとして使えるように \ を / に置換
@@ -582,12 +3528,12 @@ async def upload_background(
             path=url_path,
             user_id=current_user.id
         )
+
+        # GIFはアニメーションWebPに変換する（元のGIFは残す）
+        if file_ext == '.gif':
+            schedule_background_optimization(background.id, file_path)
             
-        return {
-            "id": background.id,
-            "filename": background.filename,
-            "path": background.path
-        }
+        return background_to_dict(background)
     except HTTPException:
         raise
     except Exception as e:
@@ -598,11 +3544,167 @@ async def upload_background(
             detail=f"背景画像のアップロードに失敗しました: {str(e)}"
         )
 
+# ハートビート受信エンドポイント（表示端末から定期的に呼ばれる）
+@app.post("/devices/heartbeat")
+async def device_heartbeat(heartbeat: DeviceHeartbeat, user_id: int = Depends(get_current_user_id)):
+    # 新しい端末は、他のワーカーが登録した端末も含めて上限を確認する
+    if SERVER_WORKERS > 1 and not heartbeat_table.known(user_id, heartbeat.device_key):
+        await anyio.to_thread.run_sync(refresh_heartbeats, user_id)
+    # メモリ上の表を更新するだけで、DBへの書き込みは定期的にまとめて行う
+    if not heartbeat_table.record(user_id, heartbeat):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"登録できる端末は{MAX_DEVICES_PER_USER}台までです",
+        )
+    return {"status": "ok", "interval": HEARTBEAT_INTERVAL}
+
+# 端末一覧（フリート状態）取得エンドポイント
+@app.get("/devices/", response_model=List[DeviceStatus])
+async def get_devices(user_id: int = Depends(get_current_user_id)):
+    if SERVER_WORKERS > 1:
+        await anyio.to_thread.run_sync(refresh_heartbeats, user_id)
+    return FastJSONResponse(jsonable_encoder(heartbeat_table.fleet(user_id)))
+
+# 再生イベント受信エンドポイント（端末からまとめて送られる）
+@app.post("/playback/events", status_code=status.HTTP_202_ACCEPTED)
+async def ingest_playback_events(batch: PlaybackEventBatch, user_id: int = Depends(get_current_user_id)):
+    if len(batch.events) > PLAYBACK_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"1回に送信できるイベントは{PLAYBACK_MAX_BATCH_SIZE}件までです",
+        )
+    if not playback_ingestor.append(user_id, batch):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="再生イベントの書き込みが追いついていません。しばらくしてから再送してください。",
+            headers={"Retry-After": str(int(PLAYBACK_FLUSH_INTERVAL))},
+        )
+    return {"accepted": len(batch.events)}
+
+# 再生レポート取得エンドポイント（集計テーブルのみを参照）
+@app.get("/playback/report")
+def get_playback_report_endpoint(
+    group_by: str = "asset",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    device_key: Optional[str] = None,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if group_by not in ("asset", "hour", "device"):
+        raise HTTPException(status_code=400, detail="group_by は asset、hour、device のいずれかを指定してください")
+    rows = get_playback_report(
+        db, current_user.id, group_by, to_local_naive(since), to_local_naive(until), device_key
+    )
+    return FastJSONResponse(jsonable_encoder({"group_by": group_by, "rows": rows}))
+
+# スケジュール枠作成エンドポイント
+@app.post("/schedules/", response_model=ScheduleSlotSchema)
+def create_schedule_endpoint(
+    slot: ScheduleSlotCreate,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if slot.days_of_week is not None:
+        if slot.start_time is None or slot.end_time is None or not slot.days_of_week:
+            raise HTTPException(status_code=400, detail="繰り返し枠には曜日と開始・終了時刻が必要です")
+        if any(day < 0 or day > 6 for day in slot.days_of_week):
+            raise HTTPException(status_code=400, detail="曜日は0（月曜）から6（日曜）で指定してください")
+    elif slot.starts_at is None or slot.ends_at is None or to_local_naive(slot.starts_at) >= to_local_naive(slot.ends_at):
+        raise HTTPException(status_code=400, detail="1回限りの枠には開始日時より後の終了日時が必要です")
+    # 参照先が現在のユーザーのものか確認
+    if get_vrm_model(db, slot.model_id, current_user.id) is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if slot.animation_id is not None and get_vrm_animation(db, slot.animation_id, current_user.id) is None:
+        raise HTTPException(status_code=404, detail="Animation not found")
+    if slot.background_id is not None:
+        background = get_background(db, slot.background_id)
+        if background is None or background.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Background not found")
+    return schedule_slot_to_dict(create_schedule_slot(db, slot, current_user.id))
+
+# スケジュール枠一覧取得エンドポイント
+@app.get("/schedules/", response_model=List[ScheduleSlotSchema])
+def get_schedules_endpoint(current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return [schedule_slot_to_dict(slot) for slot in get_schedule_slots(db, current_user.id)]
+
+# 現在（または指定日時）に表示すべきコンテンツの取得エンドポイント
+@app.get("/schedules/now")
+def get_scheduled_content(
+    at: Optional[datetime] = None,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    at = to_local_naive(at) or datetime.now()
+    entry = schedule_cache.get(db, current_user.id).resolve(at)
+    if entry is not None:
+        entry = {key: value for key, value in entry.items() if key != "slot"}
+    return {"at": at, "entry": entry}
+
+# スケジュール枠削除エンドポイント
+@app.delete("/schedules/{slot_id}")
+def delete_schedule_endpoint(
+    slot_id: int,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if not delete_schedule_slot(db, slot_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Schedule slot not found")
+    return {"status": "success"}
+
 # 背景画像一覧取得エンドポイント
 @app.get("/backgrounds/", response_model=List[BackgroundBase])
-def get_backgrounds_endpoint(current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    backgrounds = get_backgrounds(db, user_id=current_user.id)
-    return backgrounds
+def get_backgrounds_endpoint(request: Request, current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return library_list_response(
+        request, db, current_user.id, lambda: list_background_dicts(db, user_id=current_user.id)
+    )
+
+# ライブラリの変更差分取得エンドポイント
+@app.get("/library/changes")
+def get_library_changes_endpoint(
+    since: int = 0,
+    current_user: UserSchema = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    version = library_versions.get(db, current_user.id)
+    if since < 0 or since > version:
+        raise HTTPException(status_code=400, detail=f"since は 0 から {version} の範囲で指定してください")
+    changes = get_library_changes(db, current_user.id, since) if since < version else []
+    return FastJSONResponse({"version": version, "changes": changes})
+
+# ライブラリのエクスポートエンドポイント（tarをストリーミングで返す）
+@app.get("/library/export")
+def export_library(current_user: UserSchema = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    manifest = build_library_manifest(db, current_user.id)
+    return StreamingResponse(
+        iter_library_archive(manifest, current_user.id),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="library-{current_user.id}.tar"'},
+    )
+
+# ライブラリのインポートエンドポイント（リクエストボディのtarをストリーミングで読み込む）
+@app.post("/library/import")
+async def import_library(request: Request, current_user: UserSchema = Depends(get_current_active_user)):
+    reader = ArchiveStreamReader()
+    worker = asyncio.get_running_loop().run_in_executor(
+        library_import_executor, import_library_archive, reader, current_user.id
+    )
+    try:
+        async for chunk in request.stream():
+            if worker.done():
+                break
+            if chunk and not reader.try_feed(chunk):
+                # 書き込みが追いつくまで待つ（背圧）
+                await anyio.to_thread.run_sync(reader.feed, chunk)
+    finally:
+        await anyio.to_thread.run_sync(reader.feed, None)
+    try:
+        imported, to_optimize = await worker
+    except (tarfile.TarError, ValueError, KeyError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"アーカイブを読み込めませんでした: {str(e)}")
+    for background_id, file_path in to_optimize:
+        schedule_background_optimization(background_id, file_path)
+    return {"status": "success", "imported": imported}
 
 # デバッグ用エンドポイント
 @app.get("/debug/routes/", response_class=JSONResponse)
@@ -619,6 +3721,32 @@ async def get_routes():
     
     return {"status": "success", "routes": routes_info}
 
+# ファイル整合性チェック結果取得エンドポイント
+@app.get("/debug/reconcile/")
+def get_reconcile_report(current_user: UserSchema = Depends(get_current_active_user)):
+    """直近の整合性チェック結果のうち、現在のユーザーに関係するものを返す"""
+    report = upload_reconciler.report
+    return {
+        "last_pass_completed_at": report["last_pass_completed_at"],
+        "scanned_files": report["scanned_files"],
+        "quarantined_count": len(report["quarantined"]),
+        "purged": report["purged"],
+        "dangling": [row for row in report["dangling"] if row["user_id"] == current_user.id],
+    }
+
+# 階層化ストレージの状況確認エンドポイント
+@app.get("/debug/tiering/")
+def get_tiering_report(current_user: UserSchema = Depends(get_current_active_user)):
+    """直近のコールド層への移動結果と、書き戻した件数を返す"""
+    usage = shutil.disk_usage(UPLOAD_ROOT)
+    return {**tiered_storage.report, "free_bytes": usage.free, "min_free_bytes": TIERING_MIN_FREE_BYTES}
+
+# アップロードの流量制御の状況確認エンドポイント
+@app.get("/debug/uploads/")
+def get_upload_admission_status(current_user: UserSchema = Depends(get_current_active_user)):
+    """サーバー全体で処理中のアップロード数と転送中のバイト数を返す"""
+    return upload_admission.status()
+
 # シンプルなテスト用エンドポイント
 @app.get("/hello")
 def hello():
@@ -626,13 +3754,87 @@ def hello():
     return {"message": "Hello World! デバッグエンドポイントは正常に動作しています。"}
 
 # =======================
-# サーバー起動
+# マルチワーカー起動
 # =======================
 
-# サーバー起動コード（本番環境ではGunicornを使用）
-if __name__ == "__main__":
+# ワーカーが異常終了したときに再起動するまでの待ち時間（秒）
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1"))
+
+def init_worker(index: int):
+    """fork直後のワーカープロセスの初期化"""
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    # 親プロセスのDB接続は引き継がずに、このプロセスで接続し直す
+    engine.dispose(close=False)
+
+def serve(host: str, port: int, workers: int = SERVER_WORKERS):
+    """サーバーを起動する
+
+    workers が2以上なら、アプリを読み込んで静的な状態を用意してからforkし、
+    同じソケットを共有するワーカープロセスでリクエストを処理する。
+    キャッシュの無効化は invalidation_bus（共有メモリの世代カウンタ）でワーカー間に伝わる。
+    """
     import uvicorn
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    preload_static_state()
+    engine.dispose()
+    upload_admission.prepare(workers)
+    sock = uvicorn.Config(app, host=host, port=port).bind_socket()
+    children: dict = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status_code = 0
+            try:
+                init_worker(index)
+                uvicorn.Server(uvicorn.Config(app, host=host, port=port)).run(sockets=[sock])
+            except BaseException:
+                traceback.print_exc()
+                status_code = 1
+            finally:
+                os._exit(status_code)
+        children[pid] = index
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGTERM, handle_stop)
+    for index in range(workers):
+        spawn(index)
+    print(f"👷 ワーカー {workers} 個で待ち受けています")
+    while children:
+        try:
+            pid, wait_status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        # 処理中のアップロードの枠は、終了したワーカーの代わりに返却する
+        reclaimed = upload_admission.reclaim(index)
+        print(f"ワーカー {index} (pid {pid}) が終了しました（状態 {wait_status}、返却したアップロード枠 {reclaimed}）。再起動します")
+        time.sleep(WORKER_RESTART_DELAY)
+        if not stopping:
+            spawn(index)
+    sock.close()
+
+# サーバー起動コード（WORKERS=4 のように指定するとマルチワーカーで起動）
+if __name__ == "__main__":
     print("🚀 FastAPIサーバーを起動しています...")
     print("📍 URL: http://localhost:8000")
     print("📖 API ドキュメント: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    serve("0.0.0.0", 8000)
@@ -271,6 +271,11 @@ async function fetchBackgrounds() {
     }
 }
 
+// 背景画像の表示に使うURL（GIFを変換したWebPがあればそちらを使う）
+function backgroundUrl(background) {
+    return background.optimized_path || background.path;
+}
+
 // 背景画像を設定する関数
 function setBackground(backgroundPath) {
     const canvasContainer = document.getElementById('canvas-container');
@@ -279,6 +284,165 @@ function setBackground(backgroundPath) {
     }
 }
 
+// --- 表示端末のハートビート ---
+const HEARTBEAT_INTERVAL_MS = 10000;
+let heartbeatTimer = null;
+
+// 端末を識別するキー（初回に生成してlocalStorageに保存）
+function getDeviceKey() {
+    let deviceKey = localStorage.getItem('deviceKey');
+    if (!deviceKey) {
+        deviceKey = crypto.randomUUID ?
+            crypto.randomUUID() :
+            `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}`;
+        localStorage.setItem('deviceKey', deviceKey);
+    }
+    return deviceKey;
+}
+
+// 現在の表示内容をサーバーに報告
+async function sendHeartbeat() {
+    if (!accessToken) return;
+    try {
+        await fetch('/devices/heartbeat', {
+            method: 'POST',
+            headers: {
+                'Authorization': `Bearer ${accessToken}`,
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                device_key: getDeviceKey(),
+                model_id: currentModelId,
+                background_id: typeof currentBackgroundId === 'number' ? currentBackgroundId : null,
+                state: characterState
+            })
+        });
+    } catch (error) {
+        console.error('Heartbeat error:', error);
+    }
+}
+
+function startHeartbeat() {
+    startPlaybackLog();
+    if (heartbeatTimer) return;
+    sendHeartbeat();
+    heartbeatTimer = setInterval(sendHeartbeat, HEARTBEAT_INTERVAL_MS);
+}
+
+function stopHeartbeat() {
+    stopPlaybackLog();
+    clearInterval(heartbeatTimer);
+    heartbeatTimer = null;
+}
+
+// --- 再生ログ（どの端末で何をどれだけ再生したか） ---
+const PLAYBACK_FLUSH_INTERVAL_MS = 30000;
+const PLAYBACK_MAX_BUFFERED_EVENTS = 200;
+// 送信できない間に保持するイベントの上限（超えたら古いものから捨てる）
+const PLAYBACK_MAX_RETAINED_EVENTS = PLAYBACK_MAX_BUFFERED_EVENTS * 5;
+// 1回のリクエストで送るボディの上限（keepalive のリクエストは64KiBまでしか送れない）
+const PLAYBACK_MAX_REQUEST_BYTES = 48 * 1024;
+let playbackEvents = [];
+let currentPlayback = null;
+let playbackFlushTimer = null;
+let playbackFlushing = false;
+
+// 再生中のアニメーションを終了として記録
+function finishPlayback() {
+    if (!currentPlayback) return;
+    const { startedAtMs, ...event } = currentPlayback;
+    playbackEvents.push({ ...event, duration_ms: Math.round(performance.now() - startedAtMs) });
+    currentPlayback = null;
+    if (playbackEvents.length >= PLAYBACK_MAX_BUFFERED_EVENTS) {
+        flushPlaybackEvents();
+    }
+}
+
+// アニメーションの再生開始を記録
+function startPlayback(animation, type) {
+    finishPlayback();
+    if (currentModelId === null) return;
+    currentPlayback = {
+        model_id: currentModelId,
+        animation_id: animation.animationId ?? null,
+        anim_name: animation.animName ?? type,
+        started_at: new Date().toISOString(),
+        startedAtMs: performance.now()
+    };
+}
+
+// 送信できなかったイベントをバッファの先頭に戻す（上限を超えた分は古いものから捨てる）
+function requeuePlaybackEvents(events) {
+    playbackEvents = events.concat(playbackEvents).slice(-PLAYBACK_MAX_RETAINED_EVENTS);
+}
+
+// バッファの先頭から、1回のリクエストに収まる分だけ取り出す
+function takePlaybackBatch() {
+    let size = 0;
+    let count = 0;
+    while (count < playbackEvents.length) {
+        size += JSON.stringify(playbackEvents[count]).length + 1;
+        if (count > 0 && size > PLAYBACK_MAX_REQUEST_BYTES) break;
+        count++;
+    }
+    return playbackEvents.splice(0, count);
+}
+
+async function sendPlaybackBatch(events, keepalive) {
+    try {
+        const response = await fetch('/playback/events', {
+            method: 'POST',
+            keepalive,
+            headers: {
+                'Authorization': `Bearer ${accessToken}`,
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ device_key: getDeviceKey(), events })
+        });
+        if (response.status === 503) {
+            // サーバーが混み合っている場合は次回に再送
+            requeuePlaybackEvents(events);
+            return false;
+        }
+        return true;
+    } catch (error) {
+        console.error('Playback log error:', error);
+        requeuePlaybackEvents(events);
+        return false;
+    }
+}
+
+// 溜まった再生イベントを上限の大きさずつ送信
+// keepalive はページを閉じるときだけ使い、そのときは1回分だけ送る
+async function flushPlaybackEvents({ keepalive = false } = {}) {
+    if (!accessToken || playbackEvents.length === 0) return;
+    if (keepalive) {
+        sendPlaybackBatch(takePlaybackBatch(), true);
+        return;
+    }
+    if (playbackFlushing) return;
+    playbackFlushing = true;
+    try {
+        while (accessToken && playbackEvents.length > 0) {
+            if (!await sendPlaybackBatch(takePlaybackBatch(), false)) break;
+        }
+    } finally {
+        playbackFlushing = false;
+    }
+}
+
+function startPlaybackLog() {
+    if (playbackFlushTimer) return;
+    playbackFlushTimer = setInterval(flushPlaybackEvents, PLAYBACK_FLUSH_INTERVAL_MS);
+}
+
+function stopPlaybackLog() {
+    finishPlayback();
+    flushPlaybackEvents();
+    clearInterval(playbackFlushTimer);
+    playbackFlushTimer = null;
+}
+
 // --- UI操作のための関数群 ---
 // ログイン/登録フォーム切り替え
 function toggleAuthForm(isLogin) {
@@ -320,6 +484,7 @@ async function handleAuthSubmit(e, isLogin) {
         
         // モデルを読み込む
         await loadUserModels();
+        startHeartbeat();
     } else {
         messageEl.textContent = isLogin ? 
             'Login failed. Please check your email and password.' :
@@ -329,6 +494,7 @@ async function handleAuthSubmit(e, isLogin) {
 
 // ログアウト処理
 function logout() {
+    stopHeartbeat();
     localStorage.removeItem('accessToken');
     accessToken = null;
     isLoggedIn = false;
@@ -395,7 +561,7 @@ async function loadUserBackgrounds() {
         
         // 背景画像がある場合は最初の画像を設定、なければデフォルト画像
         if (backgrounds && backgrounds.length > 0) {
-            setBackground(backgrounds[0].path);
+            setBackground(backgroundUrl(backgrounds[0]));
             currentBackgroundId = backgrounds[0].id;
         } else {
             setBackground('/static/uploads/backgrounds/default.jpg');
@@ -441,9 +607,9 @@ function createBackgroundLibrary(backgrounds) {
         backgrounds.forEach(bg => {
             const thumbnail = document.createElement('div');
             thumbnail.className = 'bg-thumbnail';
-            thumbnail.style.backgroundImage = `url('${bg.path}')`;
+            thumbnail.style.backgroundImage = `url('${backgroundUrl(bg)}')`;
             thumbnail.dataset.id = bg.id;
-            thumbnail.dataset.path = bg.path;
+            thumbnail.dataset.path = backgroundUrl(bg);
             
             // 現在選択中の背景にはactiveクラスを追加
             if (bg.id === currentBackgroundId) {
@@ -456,7 +622,7 @@ function createBackgroundLibrary(backgrounds) {
                 // クリックされたサムネイルにactiveクラスを追加
                 thumbnail.classList.add('active');
                 // 背景を変更
-                setBackground(bg.path);
+                setBackground(backgroundUrl(bg));
                 currentBackgroundId = bg.id;
             });
             
@@ -490,6 +656,7 @@ async function loadUserModels() {
 
 // 特定のモデルを読み込む
 async function loadModel(modelId) {
+    finishPlayback();
     currentModelId = modelId;
     const model = userModels.find(m => m.id === modelId);
 
@@ -508,11 +675,14 @@ async function loadModel(modelId) {
     for (const anim of model.animations) {
         if (anim.anim_name.toLowerCase().includes('walk')) {
             await loadWalkAnimation(anim.vrma_path);
+            tagAnimation(walkingAnimation, anim);
         } else if (anim.anim_name.toLowerCase().includes('idle')) {
             await loadIdleAnimation(anim.vrma_path);
+            tagAnimation(idleAnimation, anim);
         } else {
             const animation = await loadActionAnimation(anim.vrma_path);
             if (animation) {
+                tagAnimation(animation, anim);
                 actionAnimations.push(animation);
             }
         }
@@ -525,6 +695,13 @@ async function loadModel(modelId) {
     toggleSettingsPanel();
 }
 
+// 再生ログ用にアニメーションへサーバー上のIDと名前を付ける
+function tagAnimation(animation, anim) {
+    if (!animation) return;
+    animation.animationId = anim.id;
+    animation.animName = anim.anim_name;
+}
+
 // --- VRMとアニメーション読み込み関連の関数群 ---
 // VRMモデルを読み込む
 async function loadVrmFromPath(path) {
@@ -882,6 +1059,9 @@ function playAnimationByType(type) {
     currentVrmAction = newAction;
     currentVrmAction.reset();
     currentVrmAction.fadeIn(0.5).play();
+
+    // 再生ログに記録
+    startPlayback(targetAnimation, type);
 }
 
 // --- 改良されたレンダーループ ---
@@ -936,6 +1116,12 @@ function init() {
     // 閉じるボタンのクリックイベント
     document.getElementById('close-panel')?.addEventListener('click', toggleSettingsPanel);
     
+    // ページを閉じる前に再生ログを送信
+    window.addEventListener('pagehide', () => {
+        finishPlayback();
+        flushPlaybackEvents({ keepalive: true });
+    });
+    
     // ログアウトボタンのクリックイベント
     document.getElementById('logout-button')?.addEventListener('click', logout);
     
@@ -1020,7 +1206,7 @@ function init() {
                     
                     // アップロードした背景をすぐに設定
                     if (result.path) {
-                        setBackground(result.path);
+                        setBackground(backgroundUrl(result));
                         currentBackgroundId = result.id;
                         
                         // 全てのサムネイルからactiveクラスを削除
@@ -1063,6 +1249,7 @@ async function validateTokenAndLoadData() {
             // トークンが有効な場合、データを読み込む
             await loadUserModels();
             await loadUserBackgrounds();
+            startHeartbeat();
         } else {
             console.log('Token validation failed:', response.status);
             // トークンが無効な場合、ログアウト処理を実行
@@ -1079,6 +1266,7 @@ async function validateTokenAndLoadData() {
 function handleInvalidToken() {
     console.log('Handling invalid token - logging out');
     
+    stopHeartbeat();
     // ローカルストレージからトークンを削除
     localStorage.removeItem('accessToken');
     accessToken = null;
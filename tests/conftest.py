@@ -0,0 +1,69 @@
+"""
+テスト共通の設定
+
+main.py はインポート時にカレントディレクトリへDBとアップロード先を作成するので、
+テストモジュールを読み込む前に一時ディレクトリへ static と templates をコピーして移動する。
+"""
+import itertools
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGINAL_CWD = os.getcwd()
+WORK_DIR = tempfile.mkdtemp(prefix="vrm-viewer-test-")
+
+def pytest_configure(config):
+    for directory in ("static", "templates"):
+        shutil.copytree(
+            os.path.join(PROJECT_DIR, directory),
+            os.path.join(WORK_DIR, directory),
+            ignore=shutil.ignore_patterns("uploads"),
+        )
+    os.chdir(WORK_DIR)
+    sys.path.insert(0, PROJECT_DIR)
+
+def pytest_unconfigure(config):
+    os.chdir(ORIGINAL_CWD)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+_user_numbers = itertools.count(1)
+
+def make_glb(extensions=("VRMC_vrm",), binary: bytes = b"\0" * 16) -> bytes:
+    """検証を通る最小限のGLB（extensions に指定した拡張を宣言する）"""
+    document = {
+        "asset": {"version": "2.0"},
+        "extensionsUsed": list(extensions),
+        "extensions": {name: {"specVersion": "1.0"} for name in extensions},
+    }
+    json_chunk = json.dumps(document).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    chunks = struct.pack("<II", len(json_chunk), 0x4E4F534A) + json_chunk
+    if binary:
+        chunks += struct.pack("<II", len(binary), 0x004E4942) + binary
+    return struct.pack("<4sII", b"glTF", 2, 12 + len(chunks)) + chunks
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+def register_user(client):
+    """新しいユーザーを登録して (ユーザーID, Authorization ヘッダー) を返す"""
+    email = f"user{next(_user_numbers)}@example.com"
+    response = client.post("/users/", json={"email": email, "password": "password"})
+    assert response.status_code == 200, response.text
+    token = client.post("/token", data={"username": email, "password": "password"}).json()["access_token"]
+    return response.json()["id"], {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def auth_headers(client):
+    return register_user(client)[1]
@@ -0,0 +1,127 @@
+"""GLBのストリーミング検証と、検証を通ったファイルだけを登録するアップロードのテスト"""
+import json
+import os
+import struct
+
+import pytest
+
+import main
+from conftest import make_glb
+from main import GLB_CHUNK_BIN, GLB_CHUNK_JSON, GLBStreamValidator, InvalidAssetError
+
+MODEL = make_glb(("VRMC_vrm",), binary=b"\1" * 64)
+ANIMATION = make_glb(("VRMC_vrm_animation",))
+
+def validate(data: bytes, required=main.VRM_MODEL_EXTENSIONS, chunk_size: int = None):
+    validator = GLBStreamValidator(required)
+    chunk_size = chunk_size or max(len(data), 1)
+    for offset in range(0, len(data), chunk_size):
+        validator.feed(data[offset:offset + chunk_size])
+    validator.finish()
+    return validator
+
+def build_glb(chunks, length_delta: int = 0) -> bytes:
+    body = b"".join(struct.pack("<II", len(data), chunk_type) + data for chunk_type, data in chunks)
+    return struct.pack("<4sII", b"glTF", 2, 12 + len(body) + length_delta) + body
+
+def json_chunk(document: dict) -> bytes:
+    data = json.dumps(document).encode("utf-8")
+    return data + b" " * (-len(data) % 4)
+
+VRM_DOCUMENT = {"asset": {"version": "2.0"}, "extensionsUsed": ["VRM"], "extensions": {"VRM": {}}}
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 8, 20, 4096])
+def test_valid_glb_in_any_chunking(chunk_size):
+    validator = validate(MODEL, chunk_size=chunk_size)
+    assert validator.chunk_count == 2
+    assert validator.position == len(MODEL)
+
+def test_vrm0_extension_and_json_only_glb():
+    validate(build_glb([(GLB_CHUNK_JSON, json_chunk(VRM_DOCUMENT))]))
+
+@pytest.mark.parametrize("cut", [0, 5, 12, 16, 30, len(MODEL) - 1])
+def test_truncated_glb_is_rejected(cut):
+    with pytest.raises(InvalidAssetError):
+        validate(MODEL[:cut], chunk_size=7)
+
+def test_trailing_data_after_declared_length_is_rejected():
+    with pytest.raises(InvalidAssetError):
+        validate(MODEL + b"\0" * 4, chunk_size=5)
+
+def test_chunk_longer_than_file_is_rejected():
+    data = bytearray(MODEL)
+    struct.pack_into("<I", data, 12, len(MODEL))
+    with pytest.raises(InvalidAssetError, match="チャンクの長さ"):
+        validate(bytes(data))
+
+def test_oversized_json_chunk_is_rejected(monkeypatch):
+    monkeypatch.setattr(main, "GLB_MAX_JSON_CHUNK_SIZE", 16)
+    with pytest.raises(InvalidAssetError, match="JSONチャンクが大きすぎます"):
+        validate(MODEL)
+
+@pytest.mark.parametrize("chunks, message", [
+    ([(GLB_CHUNK_BIN, b"\0" * 8)], "最初のチャンクがJSONではありません"),
+    ([(GLB_CHUNK_JSON, json_chunk(VRM_DOCUMENT)), (GLB_CHUNK_JSON, json_chunk(VRM_DOCUMENT))], "JSONチャンクが複数"),
+    ([(GLB_CHUNK_JSON, json_chunk(VRM_DOCUMENT)), (0x12345678, b"\0" * 4), (GLB_CHUNK_BIN, b"\0" * 4)],
+     "BINチャンク"),
+    ([(GLB_CHUNK_JSON, b"{not json}  ")], "解析できません"),
+    ([(GLB_CHUNK_JSON, json_chunk({"asset": {"version": "1.0"}}))], "glTF 2.0"),
+    ([(GLB_CHUNK_JSON, json_chunk({"asset": {"version": "2.0"}, "extensionsUsed": ["VRM"]}))], "拡張がありません"),
+])
+def test_wrong_chunks_are_rejected(chunks, message):
+    with pytest.raises(InvalidAssetError, match=message):
+        validate(build_glb(chunks), chunk_size=6)
+
+def test_unknown_chunk_after_bin_is_skipped():
+    validate(build_glb([
+        (GLB_CHUNK_JSON, json_chunk(VRM_DOCUMENT)), (GLB_CHUNK_BIN, b"\0" * 8), (0x12345678, b"\0" * 4),
+    ]), chunk_size=3)
+
+@pytest.mark.parametrize("header", [
+    struct.pack("<4sII", b"GLTF", 2, 64),
+    struct.pack("<4sII", b"glTF", 1, 64),
+    struct.pack("<4sII", b"glTF", 2, 12),
+])
+def test_bad_header_is_rejected(header):
+    with pytest.raises(InvalidAssetError):
+        validate(header + b"\0" * 52)
+
+def test_animation_requires_animation_extension():
+    with pytest.raises(InvalidAssetError):
+        validate(MODEL, required=main.VRM_ANIMATION_EXTENSIONS)
+    validate(ANIMATION, required=main.VRM_ANIMATION_EXTENSIONS)
+
+def uploaded_files(user_id: int) -> list:
+    root = os.path.join(main.UPLOAD_ROOT, str(user_id))
+    return [name for _, _, names in os.walk(root) for name in names]
+
+def test_upload_with_bad_animation_registers_nothing(client, auth_headers):
+    user_id = client.get("/users/me/", headers=auth_headers).json()["id"]
+    version = client.get("/library/changes?since=0", headers=auth_headers).json()["version"]
+    response = client.post(
+        "/upload/", headers=auth_headers, data={"name": "model"},
+        files=[
+            ("vrm_file", ("model.vrm", MODEL)),
+            ("vrma_files", ("good.vrma", ANIMATION)),
+            ("vrma_files", ("bad.vrma", MODEL[:40])),
+        ],
+    )
+    assert response.status_code == 400
+    assert "bad.vrma" in response.json()["detail"]
+    changes = client.get("/library/changes?since=0", headers=auth_headers).json()
+    assert changes["version"] == version
+    assert client.get("/models/", headers=auth_headers).json() == []
+    assert uploaded_files(user_id) == []
+
+def test_upload_registers_model_and_animations_in_one_version(client, auth_headers):
+    response = client.post(
+        "/upload/", headers=auth_headers, data={"name": "model"},
+        files=[("vrm_file", ("model.vrm", MODEL)), ("vrma_files", ("walk.vrma", ANIMATION))],
+    )
+    assert response.status_code == 200, response.text
+    changes = client.get("/library/changes?since=0", headers=auth_headers).json()
+    assert changes["version"] == 1
+    assert sorted(change["kind"] for change in changes["changes"]) == ["animation", "model"]
+    model = client.get("/models/", headers=auth_headers).json()[0]
+    assert client.get(model["vrm_path"]).content == MODEL
+    assert client.get(model["animations"][0]["vrma_path"]).content == ANIMATION
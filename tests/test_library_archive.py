@@ -0,0 +1,117 @@
+"""ライブラリのエクスポートとインポート（tarのストリーミング処理とパスの書き換え）のテスト"""
+import io
+import json
+import os
+import tarfile
+
+import main
+from conftest import make_glb, register_user
+
+MODEL = make_glb(("VRMC_vrm",), binary=b"model" * 100)
+ANIMATION = make_glb(("VRMC_vrm_animation",), binary=b"animation" * 50)
+
+def upload_library(client, headers):
+    response = client.post(
+        "/upload/", headers=headers, data={"name": "model"},
+        files=[("vrm_file", ("model.vrm", MODEL)), ("vrma_files", ("walk.vrma", ANIMATION))],
+    )
+    assert response.status_code == 200, response.text
+    with open("static/uploads/backgrounds/default.jpg", "rb") as f:
+        background = f.read()
+    response = client.post(
+        "/upload-background/", headers=headers, files=[("background_file", ("background.jpg", background))]
+    )
+    assert response.status_code == 200, response.text
+    return background
+
+def read_archive(data: bytes) -> dict:
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive if member.isfile()}
+
+def write_archive(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def import_archive(client, headers, data: bytes, chunk_size: int = 7000):
+    def body():
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    return client.post(
+        "/library/import", headers={**headers, "Content-Type": "application/x-tar"}, content=body()
+    )
+
+def list_user_files(user_id: int) -> list:
+    root = os.path.join(main.UPLOAD_ROOT, str(user_id))
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), root)
+        for directory, _, names in os.walk(root) for name in names
+    )
+
+def test_export_import_round_trip_skips_bad_members(client, auth_headers):
+    background = upload_library(client, auth_headers)
+    exported = client.get("/library/export", headers=auth_headers)
+    assert exported.status_code == 200
+    members = read_archive(exported.content)
+    manifest = json.loads(members["manifest.json"])
+    assert [model["name"] for model in manifest["models"]] == ["model"]
+
+    # 壊れたVRMを参照するモデル、ディレクトリの外を指すファイル、対象外の拡張子を追加する
+    manifest["models"].append({"name": "broken", "file": "files/broken.vrm", "animations": []})
+    members["files/broken.vrm"] = b"glTF" + b"\0" * 64
+    members["files/../../escape.vrm"] = MODEL
+    members["files/notes.txt"] = b"not a library file"
+    members["manifest.json"] = json.dumps(manifest).encode("utf-8")
+
+    importer_id, importer_headers = register_user(client)
+    response = import_archive(client, importer_headers, write_archive(members))
+    assert response.status_code == 200, response.text
+    assert response.json()["imported"] == {"models": 1, "animations": 1, "backgrounds": 1, "skipped": 1}
+
+    models = client.get("/models/", headers=importer_headers).json()
+    assert [model["name"] for model in models] == ["model"]
+    model = models[0]
+    assert model["vrm_path"].startswith(f"/uploads/{importer_id}/")
+    assert client.get(model["vrm_path"]).content == MODEL
+    assert client.get(model["animations"][0]["vrma_path"]).content == ANIMATION
+    backgrounds = client.get("/backgrounds/", headers=importer_headers).json()
+    assert client.get(backgrounds[0]["path"]).content == background
+
+    # 書き出したのは参照されている3ファイルだけで、一時ファイルやディレクトリ外のファイルは残らない
+    files = list_user_files(importer_id)
+    assert len(files) == 3
+    assert not any(name.endswith(".part") for name in files)
+    assert not os.path.exists("escape.vrm")
+    assert not os.path.exists(os.path.join(main.UPLOAD_ROOT, "escape.vrm"))
+
+def test_import_without_manifest_removes_written_files(client, auth_headers):
+    user_id = client.get("/users/me/", headers=auth_headers).json()["id"]
+    response = import_archive(client, auth_headers, write_archive({"files/model.vrm": MODEL}))
+    assert response.status_code == 400
+    assert list_user_files(user_id) == []
+
+def test_import_schedules_gif_backgrounds_without_webp(client, auth_headers, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(main, "schedule_background_optimization",
+                        lambda background_id, file_path: scheduled.append((background_id, file_path)))
+    manifest = {
+        "format": main.LIBRARY_ARCHIVE_FORMAT,
+        "models": [],
+        "backgrounds": [
+            {"filename": "loop.gif", "file": "files/backgrounds/loop.gif", "optimized_file": None},
+            {"filename": "still.png", "file": "files/backgrounds/still.png", "optimized_file": None},
+        ],
+    }
+    response = import_archive(client, auth_headers, write_archive({
+        "manifest.json": json.dumps(manifest).encode("utf-8"),
+        "files/backgrounds/loop.gif": b"GIF89a",
+        "files/backgrounds/still.png": b"\x89PNG",
+    }))
+    assert response.status_code == 200, response.text
+    backgrounds = {item["filename"]: item for item in client.get("/backgrounds/", headers=auth_headers).json()}
+    assert scheduled == [(backgrounds["loop.gif"]["id"], backgrounds["loop.gif"]["path"].lstrip("/"))]
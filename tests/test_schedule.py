@@ -0,0 +1,94 @@
+"""スケジュールの区間インデックスとコンパイル済みスケジュールのテスト"""
+import random
+from datetime import datetime, timedelta
+
+from main import MINUTES_PER_DAY, MINUTES_PER_WEEK, CompiledSchedule, IntervalIndex
+
+def brute_force_lookup(intervals, point):
+    """点を含む区間のうち、優先度 → tie_breaker が最大のものの値"""
+    covering = [interval for interval in intervals if interval[0] <= point < interval[1]]
+    if not covering:
+        return None
+    return max(covering, key=lambda interval: (interval[2], interval[3]))[4]
+
+def test_interval_index_matches_brute_force():
+    rng = random.Random(1234)
+    for _ in range(300):
+        intervals = []
+        for tie_breaker in range(rng.randint(0, 12)):
+            start = rng.randint(0, 60)
+            end = start + rng.randint(1, 30)
+            intervals.append((start, end, rng.randint(0, 3), tie_breaker, object()))
+        index = IntervalIndex(intervals)
+        for half_point in range(-2, 2 * 95):
+            point = half_point / 2
+            assert index.lookup(point) is brute_force_lookup(intervals, point)
+
+def test_interval_index_merges_adjacent_ranges_of_same_value():
+    value = object()
+    index = IntervalIndex([(0, 10, 1, 1, value), (5, 20, 0, 2, object()), (10, 15, 1, 1, value)])
+    assert index.starts == [0, 15]
+    assert index.ends == [15, 20]
+
+def test_interval_index_empty():
+    index = IntervalIndex([])
+    assert index.lookup(0) is None
+
+def make_entry(slot_id, priority, days_of_week=None, start_minute=None, end_minute=None,
+               starts_at=None, ends_at=None):
+    return {
+        "slot": {
+            "id": slot_id,
+            "priority": priority,
+            "days_of_week": days_of_week,
+            "start_minute": start_minute,
+            "end_minute": end_minute,
+            "starts_at": starts_at,
+            "ends_at": ends_at,
+        },
+        "slot_id": slot_id,
+    }
+
+def covers_weekly(slot, minute_of_week):
+    length = (slot["end_minute"] - slot["start_minute"]) % MINUTES_PER_DAY or MINUTES_PER_DAY
+    for day in slot["days_of_week"]:
+        start = day * MINUTES_PER_DAY + slot["start_minute"]
+        if (minute_of_week - start) % MINUTES_PER_WEEK < length:
+            return True
+    return False
+
+# 2024-01-01 は月曜日
+MONDAY = datetime(2024, 1, 1)
+
+def test_weekly_slot_wraps_from_sunday_to_monday():
+    entry = make_entry(1, 0, days_of_week=[6], start_minute=23 * 60, end_minute=60)
+    schedule = CompiledSchedule([entry])
+    assert schedule.resolve(MONDAY + timedelta(days=6, hours=23, minutes=30)) is entry
+    assert schedule.resolve(MONDAY + timedelta(minutes=30)) is entry
+    assert schedule.resolve(MONDAY + timedelta(hours=1)) is None
+    assert schedule.resolve(MONDAY + timedelta(days=6, hours=22, minutes=59)) is None
+
+def test_weekly_schedule_matches_brute_force():
+    rng = random.Random(42)
+    for _ in range(40):
+        entries = []
+        for slot_id in range(1, rng.randint(1, 8)):
+            days = sorted(rng.sample(range(7), rng.randint(1, 3)))
+            start = rng.randrange(0, MINUTES_PER_DAY, 30)
+            end = rng.randrange(0, MINUTES_PER_DAY, 30)
+            entries.append(make_entry(slot_id, rng.randint(0, 2), days, start, end))
+        schedule = CompiledSchedule(entries)
+        for minute_of_week in range(0, MINUTES_PER_WEEK, 15):
+            covering = [entry for entry in entries if covers_weekly(entry["slot"], minute_of_week)]
+            expected = max(covering, key=lambda entry: (entry["slot"]["priority"], entry["slot_id"])) if covering else None
+            assert schedule.resolve(MONDAY + timedelta(minutes=minute_of_week)) is expected
+
+def test_one_off_slot_wins_ties_and_loses_to_higher_priority():
+    weekly = make_entry(1, 1, days_of_week=list(range(7)), start_minute=0, end_minute=0)
+    once = make_entry(2, 1, starts_at=MONDAY + timedelta(hours=9), ends_at=MONDAY + timedelta(hours=10))
+    urgent = make_entry(3, 2, days_of_week=[0], start_minute=9 * 60 + 30, end_minute=9 * 60 + 45)
+    schedule = CompiledSchedule([weekly, once, urgent])
+    assert schedule.resolve(MONDAY + timedelta(hours=8)) is weekly
+    assert schedule.resolve(MONDAY + timedelta(hours=9, minutes=10)) is once
+    assert schedule.resolve(MONDAY + timedelta(hours=9, minutes=40)) is urgent
+    assert schedule.resolve(MONDAY + timedelta(hours=10)) is weekly